@@ -0,0 +1,103 @@
+STATUSES = ['Pending', 'Confirmed', 'Rejected']
+QUEUE_COLUMNS = "id, sender_name, sender_number, reference_type, screenshot, status, item_name"
+
+# Largest IN list sent in one statement by the bulk actions
+BATCH_SIZE = 500
+
+
+# A view of the queue is a list of segments read in order: (WHERE clause, params, direction).
+# Pending requests come first, oldest first, so they are handled in the order they arrived;
+# requests already decided follow, newest first.
+def queue_segments(status):
+    if status == 'Pending':
+        return [("status = %s", ('Pending',), 'ASC')]
+    if status in STATUSES:
+        return [("status = %s", (status,), 'DESC')]
+    return [("status = %s", ('Pending',), 'ASC'), ("status <> %s", ('Pending',), 'DESC')]
+
+
+# Cursors are "<segment>:<last id>" so paging can continue across segments
+def encode_cursor(segment, request_id):
+    return f"{segment}:{request_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        segment, request_id = cursor.split(':', 1)
+        return int(segment), int(request_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# One page of the queue (keyset-paginated per segment); returns (requests, next_cursor)
+def get_queue_page(cursor, status='all', after=None, limit=50):
+    segments = queue_segments(status)
+    start, last_id = decode_cursor(after) if after else (0, None)
+    if start >= len(segments):
+        raise ValueError(f"Invalid cursor: {after}")
+
+    rows = []
+    for index in range(start, len(segments)):
+        where, params, direction = segments[index]
+        params = list(params)
+        if index == start and last_id is not None:
+            where += f" AND id {'>' if direction == 'ASC' else '<'} %s"
+            params.append(last_id)
+        cursor.execute(
+            f"SELECT {QUEUE_COLUMNS} FROM handle_request WHERE {where} ORDER BY id {direction} LIMIT %s",
+            tuple(params) + (limit + 1 - len(rows),)
+        )
+        rows.extend(dict(row, segment=index) for row in cursor.fetchall())
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['segment'], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def count_pending(cursor):
+    cursor.execute("SELECT COUNT(*) AS pending FROM handle_request WHERE status = %s", ('Pending',))
+    return cursor.fetchone()['pending']
+
+
+# Set the status of many requests in one transaction and log each change in status_history.
+# Requests already in that status are left alone; returns the reference types that changed.
+def set_request_status(conn, reference_types, status):
+    if status not in STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+    reference_types = list(dict.fromkeys(r for r in reference_types if r))
+    cursor = conn.cursor()
+    changed = []
+    try:
+        for start in range(0, len(reference_types), BATCH_SIZE):
+            batch = reference_types[start:start + BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            # Lock the rows so two admins acting at once can't both log the same change
+            cursor.execute(
+                f"SELECT reference_type FROM handle_request WHERE reference_type IN ({placeholders}) "
+                "AND status <> %s FOR UPDATE",
+                tuple(batch) + (status,)
+            )
+            pending = list(dict.fromkeys(row[0] for row in cursor.fetchall()))
+            if not pending:
+                continue
+            cursor.execute(
+                f"UPDATE handle_request SET status = %s WHERE reference_type IN ({', '.join(['%s'] * len(pending))})",
+                (status,) + tuple(pending)
+            )
+            changed.extend(pending)
+        if changed:
+            cursor.executemany(
+                "INSERT INTO status_history (reference_type, status) VALUES (%s, %s)",
+                [(reference_type, status) for reference_type in changed]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return changed
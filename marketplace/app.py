@@ -1,32 +1,48 @@
 import os
 import json  # Make sure to import json for handling JSON data
+import hashlib
+import time
+import itertools
+import math
 from functools import wraps
-from flask import Flask, jsonify, render_template, request, redirect, url_for, session, flash
-from PIL import Image
+from decimal import Decimal, InvalidOperation
+from flask import Flask, Response, jsonify, render_template, stream_template, request, redirect, url_for, session, flash, abort
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-import mysql.connector
-import MySQLdb
-from mysql.connector import Error
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from dotenv import load_dotenv
-import cloudinary
-import cloudinary.uploader
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET')
-)
+import db
+from db import get_db, PoolExhausted
+import metrics
+from search import search_items
+import migrations
+import query_audit
+import benchmark
+import storage
+import uploads
+import cache
+import status_events
+from cache import get_cache, LRUCache
+from markupsafe import Markup
+import upload_limits
+from upload_limits import validate_image
+from uploads import spool_files
+from images import image_sources, detail_image_sources, image_size
+from item_images import save_item_images, load_item_images
+from storage import add_refs, release_refs, collect_garbage
+from admin_queue import STATUSES, get_queue_page, count_pending, set_request_status
+import facets
+import similar
+import bulk_items
+import assets
+import startup
+import throttle
+from throttle import HasherBusy, check_limits, get_hasher
+from saved import get_saved_ids, invalidate_saved, parse_item_ids, remove_items, save_items
+from facets import PRICE_BUCKETS, adjust_facets, bucket_label, get_facets, price_bucket
+from similar import load_similar_items
 
 app = Flask(__name__)
-# app.secret_key = 'your_secret_key'  # Required for session management
-app.secret_key = os.environ.get('SECRET_KEY', 'default_secret_key')
-
 
 # Set the upload folders for item grid and detail images
 GRID_UPLOAD_FOLDER = 'static/uploads/grid_images'
@@ -34,55 +50,141 @@ DETAIL_UPLOAD_FOLDER = 'static/uploads/detail_images'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 UPLOAD_FOLDER = 'static/uploads'
 
+# Templates build <picture> srcsets from an item's grid_variants
+app.add_template_global(image_sources)
+app.add_template_global(detail_image_sources)
 
-app.config['GRID_UPLOAD_FOLDER'] = GRID_UPLOAD_FOLDER
-app.config['DETAIL_UPLOAD_FOLDER'] = DETAIL_UPLOAD_FOLDER
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Only the columns a grid card needs (keeps description/detail_images out of listings)
+GRID_COLUMNS = "id, name, price, grid_image, grid_variants, category, quality"
 
-# Ensure that the upload directories exist
-os.makedirs(GRID_UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DETAIL_UPLOAD_FOLDER, exist_ok=True)
-
-# Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
+
+
+# Application factory: `gunicorn 'app:create_app()'`, `flask --app app:create_app ...`.
+# Importing this module only defines the routes; configuration, extensions and anything
+# that touches the filesystem happen here, and nothing connects to MySQL until the first
+# request or the warm-up (see startup.py). Schema changes are applied by `flask migrate`.
+# The routes are registered on the module's `app`, so it is configured once and reused.
+def create_app(config=None):
+    if 'startup' in app.extensions:
+        return app
+    started = time.perf_counter()
+
+    # Load environment variables from .env file
+    load_dotenv()
+    app.config.update(config or {})
+    app.secret_key = app.config.get('SECRET_KEY') or os.environ.get('SECRET_KEY', 'default_secret_key')
+
+    app.config.setdefault('GRID_UPLOAD_FOLDER', GRID_UPLOAD_FOLDER)
+    app.config.setdefault('DETAIL_UPLOAD_FOLDER', DETAIL_UPLOAD_FOLDER)
+    app.config.setdefault('UPLOAD_FOLDER', UPLOAD_FOLDER)
+
+    # Listing pagination: default page size and the hard cap a client can ask for
+    app.config.setdefault('ITEMS_PAGE_SIZE', int(os.environ.get('ITEMS_PAGE_SIZE', 24)))
+    app.config.setdefault('ITEMS_MAX_PAGE_SIZE', int(os.environ.get('ITEMS_MAX_PAGE_SIZE', 100)))
+
+    # Proofs of payment shown per page of the admin review queue
+    app.config.setdefault('ADMIN_PAGE_SIZE', int(os.environ.get('ADMIN_PAGE_SIZE', 50)))
+
+    # Unpaginated pages (saved items, a seller's listings) are streamed; rendered HTML is sent
+    # in writes of at least this many characters
+    app.config.setdefault('STREAM_CHUNK_SIZE', int(os.environ.get('STREAM_CHUNK_SIZE', 16 * 1024)))
+
+    # Ensure that the upload directories exist
+    os.makedirs(app.config['GRID_UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['DETAIL_UPLOAD_FOLDER'], exist_ok=True)
+
+    # Initialize Flask-Login
+    login_manager.init_app(app)
+
+    # Initialize the database connection pool (connections are opened on demand)
+    db.init_app(app)
+
+    # Per-endpoint latency, DB/render/upload time and query counts on /metrics
+    metrics.init_app(app)
+
+    # Register the `flask migrate`, `flask explain-audit`, `flask bench`, `flask rebuild-facets`,
+    # `flask build-similar`, `flask import-items`/`export-items` and `flask warm-up`/`import-time` commands
+    migrations.init_app(app)
+    query_audit.init_app(app)
+    benchmark.init_app(app)
+    facets.init_app(app)
+    similar.init_app(app)
+    bulk_items.init_app(app)
+    startup.init_app(app)
+
+    # Request size caps per endpoint and disk spooling for uploaded files
+    upload_limits.init_app(app)
+
+    # Two-tier cache for listing queries, rendered cards and item pages
+    cache.init_app(app)
+
+    # Bounded, TTL'd cache of logged-in User records for load_user
+    app.config.setdefault('USER_CACHE_SIZE', int(os.environ.get('USER_CACHE_SIZE', 10000)))
+    app.config.setdefault('USER_CACHE_TTL', int(os.environ.get('USER_CACHE_TTL', 300)))
+    app.extensions['user_cache'] = LRUCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+    # Pub/sub that pushes payment status changes to waiting buyers (/status_events)
+    status_events.init_app(app)
+
+    # Content-addressed upload storage, then the upload backend, pool and background queue
+    storage.init_app(app)
+    uploads.init_app(app, on_update=lambda item_id: invalidate_items(item_id))
+
+    # Fingerprinted, precompressed static assets served with immutable caching
+    assets.init_app(app)
+
+    # Login/sign-up rate limits and the bounded password-hashing pool
+    throttle.init_app(app)
+
+    app.extensions['startup'] = {'create_app_ms': (time.perf_counter() - started) * 1000}
+    return app
 
 # Allowed file check
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Database connection
-def get_db_connection():
-    return mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='',  # No password
-        database='marketplace'
-    )
-
-# Create the items table
-def create_items_table():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS items (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            price DECIMAL(10, 2) NOT NULL,
-            description TEXT NOT NULL,
-            quality ENUM('new', 'used_like_new', 'used_good', 'used_fair') NOT NULL,
-            category VARCHAR(100) NOT NULL,
-            meetup_place VARCHAR(255) NOT NULL,
-            seller_phone VARCHAR(15) NOT NULL,
-            grid_image VARCHAR(255),
-            detail_images TEXT,
-            user_id INT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
-    conn.commit()
-    cursor.close()
-    conn.close()
+# Allowed upload check: extension, per-file size cap and the image's magic bytes
+def allowed_upload(file):
+    return allowed_file(file.filename) and validate_image(file, app.config['UPLOAD_MAX_FILE_SIZE'])
+
+# Uploads over the endpoint's size cap are refused before the body is read in full
+@app.errorhandler(413)
+def handle_upload_too_large(e):
+    if request.endpoint == 'update_profile_picture':
+        return jsonify({'success': False, 'error': 'File is too large'}), 413
+    return "The uploaded files are too large.", 413
+
+# Return 503 instead of hanging when every pooled connection is busy
+@app.errorhandler(PoolExhausted)
+def handle_pool_exhausted(e):
+    return "The server is busy, please try again shortly.", 503
+
+# Pool metrics (wait time, checkouts, exhaustion count)
+@app.route('/pool_stats')
+def pool_stats():
+    return jsonify(db.get_pool().stats())
+
+# Cache hit/miss statistics
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({**get_cache().stats(), 'users': app.extensions['user_cache'].stats(),
+                    'status_events': status_events.get_broker().stats()})
+
+# Invalidate cached pages for changed items; 'listings' covers every list/search page
+# and 'facets' the filter-menu counts (bump it whenever item_facets was adjusted)
+def invalidate_items(*item_ids, listings=True, facets=False):
+    namespaces = [f'item:{item_id}' for item_id in item_ids]
+    if listings:
+        namespaces.append('listings')
+    if facets:
+        namespaces.append('facets')
+    app.extensions['cache'].bump(*namespaces)
+
+# The seller's username and picture are shown on each of their item pages
+def invalidate_seller_items(cursor, user_id):
+    cursor.execute("SELECT id FROM items WHERE user_id = %s", (user_id,))
+    invalidate_items(*[row[0] for row in cursor.fetchall()], listings=False)
 
 # Example in-memory database (replace with a real database for production)
 proofs_data = []
@@ -92,8 +194,6 @@ proofs_data = []
 @login_required
 def user_info():
     user_id = session['user_id']
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
 
     if request.method == 'POST':
         # Handle form submission for user info updates
@@ -103,50 +203,58 @@ def user_info():
         email = request.form['email']
 
         # Update user information
+        conn = get_db()
+        cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET first_name = %s, last_name = %s, username = %s, email = %s WHERE id = %s",
             (first_name, last_name, username, email, user_id)
         )
         conn.commit()
+        invalidate_user(user_id)
+        invalidate_seller_items(cursor, user_id)
+        cursor.close()
 
-    # Fetch current user information
-    cursor.execute(
-        "SELECT first_name, last_name, username, email, profile_picture FROM users WHERE id = %s", 
-        (user_id,)
-    )
-    user_data = cursor.fetchone()
-    
-    # Debug: Print user data to console
-    print("User Data:", user_data)  # This will help debug if the profile_picture URL is being retrieved
-
-    # Fetch posted items
-    posted_items = get_user_items(user_id)
+    # Current user information and their posted items in one round trip; the items are
+    # rendered as they are read. The stream has its own connection, so the request's
+    # (taken for the update or by the user loader) goes back to the pool first.
+    db.release_db()
+    user_data, posted_items = get_user_with_items(user_id)
+    return stream_page('user_info.html', user=user_data, posted_items=posted_items)
 
-    cursor.close()
-    conn.close()
 
-    return render_template('user_info.html', user=user_data, posted_items=posted_items)
 
+# User class for Flask-Login
+# Compact record (no per-instance __dict__) since one is cached per active user;
+# implements the Flask-Login user interface itself because UserMixin has no __slots__
+class User:
+    __slots__ = ('id', 'username', 'email', 'profile_picture')
 
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
 
-# User class for Flask-Login
-class User(UserMixin):
-    def __init__(self, id, username, email):
+    def __init__(self, id, username, email, profile_picture=None):
         self.id = id
         self.username = username
         self.email = email
-        self.profile_picture = None
+        self.profile_picture = profile_picture
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, User) and self.get_id() == other.get_id()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
 
 # Index route to display homepage
 @app.route('/')
 def index():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)  # Use dictionary cursor for named access
-    cursor.execute("SELECT * FROM items")  # Fetch all items from the database
-    items = cursor.fetchall()  # Get all items as a list of dictionaries
-    cursor.close()
-    conn.close()
-    return render_template('homepage.html', items=items)
+    # homepage.html is the login/landing page and doesn't list items
+    return render_template('homepage.html')
 
 # Homepage route
 @app.route('/homepage')
@@ -161,51 +269,32 @@ def homepage():
 # Route for searching and filtering items
 @app.route('/search', methods=['GET'])
 def search():
-    query = request.args.get('query', '').lower()  # Get the search query
+    query = request.args.get('query', '')  # Get the search query
     min_price = request.args.get('min_price', type=int)  # Get min price filter
     max_price = request.args.get('max_price', type=int)  # Get max price filter
     quality = request.args.get('quality')  # Get quality filter
     category = request.args.get('category')  # Get category filter
+    sort = request.args.get('sort', 'relevance')
+    page = request.args.get('page', 1, type=int)
 
-    # Start building the SQL query
-    sql = "SELECT * FROM items WHERE LOWER(name) LIKE %s OR LOWER(description) LIKE %s"
-    params = ['%' + query + '%', '%' + query + '%']
-
-    # Add price filters if provided
-    if min_price is not None:
-        sql += " AND price >= %s"
-        params.append(min_price)
-    
-    if max_price is not None:
-        sql += " AND price <= %s"
-        params.append(max_price)
-
-    # Add quality filter if provided and not "all"
-    if quality and quality != 'all':
-        sql += " AND quality = %s"
-        params.append(quality)
-
-    # Add category filter if provided and not "all"
-    if category and category != 'all':
-        sql += " AND category = %s"
-        params.append(category)
+    # Full-text search with filters, ranked by relevance (see search.py)
+    per_page = get_page_size()
+    cache = get_cache()
+    key = f"search:{cache.version('listings')}:{(query, min_price, max_price, quality, category, sort, page, per_page)!r}"
+    results, has_next = cache.get_or_set(key, lambda: search_items(
+        query, min_price, max_price, quality, category, sort=sort, page=page, per_page=per_page
+    ))
 
-    # Execute the query
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(sql, tuple(params))
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    return render_template('search_results.html', query=query, results=results, category=category, quality=quality, min_price=min_price, max_price=max_price)
+    return render_template('search_results.html', query=query, results=results, category=category, quality=quality,
+                           saved_ids=get_saved_ids(session.get('user_id')),
+                           min_price=min_price, max_price=max_price, sort=sort, page=page, has_next=has_next)
 
 
 # Route to update an item
 @app.route('/update_item/<int:item_id>', methods=['GET', 'POST'])
 @login_required
 def update_item(item_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     # Fetch item details if GET request
@@ -213,7 +302,6 @@ def update_item(item_id):
         cursor.execute("SELECT * FROM items WHERE id = %s AND user_id = %s", (item_id, session['user_id']))
         item = cursor.fetchone()
         cursor.close()
-        conn.close()
         if item:
             return render_template('update_item.html', item=item)
         else:
@@ -224,111 +312,262 @@ def update_item(item_id):
         name = request.form['name']
         price = request.form['price']
         grid_image = request.form.get('grid_image')  # Update image if needed
+        cursor.execute(
+            "SELECT category, quality, price FROM items WHERE id = %s AND user_id = %s FOR UPDATE",
+            (item_id, session['user_id'])
+        )
+        old = cursor.fetchone()
         cursor.execute(
             "UPDATE items SET name = %s, price = %s, grid_image = %s WHERE id = %s AND user_id = %s",
             (name, price, grid_image, item_id, session['user_id'])
         )
+        # A price change can move the item to another price bucket
+        moved = old is not None and price_bucket(old['price']) != price_bucket(price)
+        if moved:
+            adjust_facets(cursor, [(old['category'], old['quality'], old['price'], -1),
+                                   (old['category'], old['quality'], price, 1)])
         conn.commit()
+        invalidate_items(item_id, facets=moved)
         cursor.close()
-        conn.close()
         return redirect(url_for('user_info'))
 
 # Route to delete an item
 @app.route('/delete_item/<int:item_id>', methods=['POST'])
 @login_required
 def delete_item(item_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
+    cursor.execute(
+        "SELECT category, quality, price FROM items WHERE id = %s AND user_id = %s FOR UPDATE",
+        (item_id, session['user_id'])
+    )
+    old = cursor.fetchone()
     cursor.execute("DELETE FROM items WHERE id = %s AND user_id = %s", (item_id, session['user_id']))
+    released = []
+    if cursor.rowcount:
+        released = release_refs(cursor, 'item', item_id)
+        adjust_facets(cursor, [old + (-1,)])
     conn.commit()
     cursor.close()
-    conn.close()
+    invalidate_items(item_id, facets=bool(old))
+
+    # Remove stored images no other item or proof still uses
+    store = app.extensions['blob_store']
+    collect_garbage(conn, store, released, grace=app.config['BLOB_GC_GRACE'])
     return redirect(url_for('user_info'))
 
 
-# Function to get user items
-def get_user_items(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM items WHERE user_id = %s", (user_id,))
-    items = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return items
+# Profile fields plus the user's items (grid columns), from a single LEFT JOIN. The profile
+# comes from the first row; the items are a generator over the rest of the streamed result.
+# Reading the first row checks out the stream's connection: call db.release_db() before.
+USER_ITEM_COLUMNS = [column.strip() for column in GRID_COLUMNS.split(',')]
 
-# Function to get all items
-def get_all_items():
-    conn = get_db_connection()
+USER_WITH_ITEMS_SQL = (
+    "SELECT u.first_name, u.last_name, u.username, u.email, u.profile_picture, "
+    f"{', '.join(f'i.{column} AS item_{column}' for column in USER_ITEM_COLUMNS)} "
+    "FROM users u LEFT JOIN items i ON i.user_id = u.id WHERE u.id = %s ORDER BY i.id DESC"
+)
+
+def get_user_with_items(user_id):
+    rows = db.stream_query(USER_WITH_ITEMS_SQL, (user_id,))
+    first = next(rows, None)
+    if first is None:
+        return None, iter(())
+    user = {key: first[key] for key in ('first_name', 'last_name', 'username', 'email', 'profile_picture')}
+    items = (
+        {column: row[f'item_{column}'] for column in USER_ITEM_COLUMNS}
+        for row in itertools.chain([first], rows) if row['item_id'] is not None
+    )
+    return user, items
+
+# Render a template as a stream instead of building the whole page first, for pages whose
+# row count isn't bounded; pass rows as db.stream_query() generators so they are fetched as
+# the template loop reaches them. The request's own connection is released first.
+def stream_page(template_name, **context):
+    db.release_db()
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    pieces = metrics.timed_stream(stream_template(template_name, **context))
+
+    def chunks():
+        buffer, buffered = [], 0
+        for piece in pieces:
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= chunk_size:
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            yield ''.join(buffer)
+    return Response(chunks(), mimetype='text/html')
+
+# Sort orders for listing pages: (sort column, direction); id always breaks ties
+ITEM_SORTS = {
+    'newest': ('id', 'DESC'),
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+}
+
+def get_page_size():
+    limit = request.args.get('limit', type=int) or app.config['ITEMS_PAGE_SIZE']
+    return max(1, min(limit, app.config['ITEMS_MAX_PAGE_SIZE']))
+
+# Cursors are "<id>" for the newest sort and "<price>_<id>" for price sorts
+def encode_cursor(item, sort):
+    if sort == 'newest':
+        return str(item['id'])
+    return f"{item['price']}_{item['id']}"
+
+def decode_cursor(cursor, sort):
+    try:
+        if sort == 'newest':
+            return (int(cursor),)
+        price, item_id = cursor.rsplit('_', 1)
+        return (Decimal(price), int(item_id))
+    except (ValueError, InvalidOperation):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+# SQL and parameters for one keyset page of grid rows (also rendered by the explain audit)
+def items_page_query(category, sort, after, limit):
+    if sort not in ITEM_SORTS:
+        raise ValueError(f"Invalid sort: {sort}")
+    column, direction = ITEM_SORTS[sort]
+    op = '<' if direction == 'DESC' else '>'
+
+    where = []
+    params = []
+    if category and category != 'all':
+        where.append("category = %s")
+        params.append(category)
+    if after:
+        position = decode_cursor(after, sort)
+        if sort == 'newest':
+            where.append(f"id {op} %s")
+            params.append(position[0])
+        else:
+            # Ties on price are broken by id so no row is skipped or repeated
+            where.append(f"(price {op} %s OR (price = %s AND id {op} %s))")
+            params.extend([position[0], position[0], position[1]])
+
+    sql = f"SELECT {GRID_COLUMNS} FROM items"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {column} {direction}"
+    if column != 'id':
+        sql += f", id {direction}"
+    sql += " LIMIT %s"
+    params.append(limit + 1)  # One extra row tells us whether another page exists
+    return sql, tuple(params)
+
+# Keyset pagination over items: returns one page of grid rows plus the cursor for the next page
+def get_items_page(category=None, sort='newest', after=None, limit=None):
+    limit = limit or app.config['ITEMS_PAGE_SIZE']
+    sql, params = items_page_query(category, sort, after, limit)
+
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM items")
+    cursor.execute(sql, params)
     items = cursor.fetchall()
     cursor.close()
-    conn.close()
-    return items
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1], sort)
+    return items, next_cursor
+
+# Listing pages are cached under the current 'listings' version; callers must not mutate the rows
+def cached_items_page(category, sort, after, limit):
+    cache = get_cache()
+    key = f"items_page:{cache.version('listings')}:{category}:{sort}:{after}:{limit}"
+    return cache.get_or_set(key, lambda: get_items_page(category, sort, after, limit))
+
+# Rendered grid card, keyed by every column it displays so any edit yields a new key
+@app.template_global()
+def item_card(item, compact=False, saved=False):
+    fingerprint = hashlib.md5(
+        repr((item['name'], str(item['price']), item['grid_image'], item.get('grid_variants'))).encode()
+    ).hexdigest()
+    key = f"card:{item['id']}:{int(compact)}:{int(saved)}:{fingerprint}"
+    return Markup(get_cache().get_or_set(
+        key, lambda: render_template('_item_card.html', item=item, compact=compact, saved=saved)
+    ))
+
+def render_items_page(category='all'):
+    sort = request.args.get('sort', 'newest')
+    try:
+        all_items, next_cursor = cached_items_page(category, sort, request.args.get('cursor'), get_page_size())
+    except ValueError:
+        abort(400)
+    category_counts = get_facets().counts()['category']
+    return render_template('main_index.html', all_items=all_items, category_counts=category_counts,
+                           saved_ids=get_saved_ids(session.get('user_id')),
+                           next_cursor=next_cursor, category=category, sort=sort)
 
 # Route for main index
 @app.route('/main_index')
 @login_required  # Ensure the user is logged in
 def main_index():
-    user_id = session['user_id']  # Assuming user_id is stored in the session
-    user_items = get_user_items(user_id)  # Fetch user items from the database
-    all_items = get_all_items()  # Fetch all items for display
-    return render_template('main_index.html', user_items=user_items, all_items=all_items)
+    return render_items_page()
 
 
 @app.route('/filter/<category>', methods=['GET'])
 @login_required
 def filter_by_category(category):
-    user_id = session['user_id']
-    user_items = get_user_items(user_id)
-    
-    if category == 'all':
-        all_items = get_all_items()
-    else:
-        all_items = get_items_by_category(category)  # Fetch items filtered by category
-    
-    return render_template('main_index.html', user_items=user_items, all_items=all_items)
-
-def get_items_by_category(category):
-    connection = None  # Initialize connection variable here to avoid reference errors
+    return render_items_page(category)
+
+# Live counts for filter menus, from the in-memory facet summary (no per-request GROUP BY)
+@app.route('/api/facets', methods=['GET'])
+def api_facets():
+    bucket = request.args.get('price_bucket', type=int)
+    if bucket is not None and not 0 <= bucket < len(PRICE_BUCKETS):
+        return jsonify({'error': 'Invalid price bucket'}), 400
+    counts = get_facets().counts(request.args.get('category'), request.args.get('quality'), bucket)
+    counts['price_buckets'] = [bucket_label(b) for b in range(len(PRICE_BUCKETS))]
+    return jsonify(counts)
+
+# JSON "load more" endpoint used by the listing grid
+@app.route('/api/items', methods=['GET'])
+def api_items():
+    sort = request.args.get('sort', 'newest')
     try:
-        # Set up the database connection
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='',  # No password
-            database='marketplace'
-        )
-
-        if connection.is_connected():
-            cursor = connection.cursor(dictionary=True)  # Use dictionary for easier column-to-field mapping
-            query = "SELECT * FROM items WHERE category = %s"
-            cursor.execute(query, (category,))
-            items = cursor.fetchall()  # Fetch all items that match the category
-            cursor.close()
-            return items
-        else:
-            print("Unable to connect to the database")
-            return []
-
-    except Error as e:
-        print(f"Error: {e}")
-        return []
-
-    finally:
-        # Make sure the connection is only closed if it was initialized
-        if connection is not None and connection.is_connected():
-            connection.close()
+        items, next_cursor = cached_items_page(request.args.get('category'), sort,
+                                               request.args.get('cursor'), get_page_size())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    saved_ids = get_saved_ids(session.get('user_id'))
+    items = [
+        {**{k: v for k, v in item.items() if k != 'grid_variants'}, 'sources': image_sources(item),
+         'saved': item['id'] in saved_ids}
+        for item in items
+    ]
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 
 @app.route('/item/<int:item_id>')
 def item_detail(item_id):
-    conn = get_db_connection()
+    # The page differs for guests and logged-in users, and pending flash messages are
+    # rendered into it, so those requests always render fresh
+    cache = get_cache()
+    key = (f"item_detail:{item_id}:{cache.version(f'item:{item_id}')}:{cache.version('similar')}:"
+           f"{int(bool(session.get('user_id')))}")
+    if not session.get('_flashes'):
+        page = cache.get(key)
+        if page is not None:
+            return page
+        page = render_item_detail(item_id)
+        if isinstance(page, str):
+            cache.set(key, page)
+        return page
+    return render_item_detail(item_id)
+
+def render_item_detail(item_id):
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     # Join the items table with users table to get seller information including profile picture
     cursor.execute("""
-        SELECT i.*, u.username, u.profile_picture 
+        SELECT i.id, i.name, i.price, i.description, i.quality, i.category, i.meetup_place,
+               i.seller_phone, i.grid_image, i.user_id, u.username, u.profile_picture
         FROM items i 
         LEFT JOIN users u ON i.user_id = u.id 
         WHERE i.id = %s
@@ -339,19 +578,21 @@ def item_detail(item_id):
     if item:
         # Convert the quality value to a more readable format
         item_quality = item['quality'].replace('_', ' ').title()
+        images = load_item_images(cursor, [item_id])[item_id]
+        # Precomputed by `flask build-similar`; empty until it has run
+        similar_items = load_similar_items(cursor, item_id)
         cursor.close()
-        conn.close()
-        return render_template('item_detail.html', item=item, item_quality=item_quality)
+        return render_template('item_detail.html', item=item, images=images, item_quality=item_quality,
+                               similar_items=similar_items)
     else:
         cursor.close()
-        conn.close()
         return "Item not found", 404
 
 
 
 @app.route('/item/<int:item_id>', methods=['GET'])
 def item_details(item_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Query to get item details and username of the seller
@@ -363,7 +604,6 @@ def item_details(item_id):
     """, (item_id,))
     item = cursor.fetchone()
 
-    conn.close()
 
     if item:
         return render_template('item_details.html', item=item)
@@ -378,52 +618,71 @@ def save_item(item_id):
     if not user_id:
         return redirect(url_for('login'))  # Redirect if user not logged in
 
-    conn = get_db_connection()
+    # One atomic upsert instead of check-then-insert (see saved.py)
+    conn = get_db()
     cursor = conn.cursor()
+    saved = save_items(cursor, user_id, [item_id])
+    conn.commit()
+    cursor.close()
 
-    # Check if the item is already saved
-    cursor.execute("""
-        SELECT 1 FROM saved_items WHERE user_id = %s AND item_id = %s
-    """, (user_id, item_id))
-    existing_item = cursor.fetchone()
-
-    if existing_item:
-        # Item is already saved, return an error message
-        cursor.close()
-        conn.close()
+    if saved:
+        invalidate_saved(user_id)
+        return jsonify({'status': 'success', 'message': 'Item saved successfully.'})
+    if item_id in get_saved_ids(user_id):
         return jsonify({'status': 'error', 'message': 'This item is already saved.'})
+    return jsonify({'status': 'error', 'message': 'This item no longer exists.'}), 404
 
-    # Insert the item into saved_items if not already saved
-    cursor.execute("""
-        INSERT INTO saved_items (user_id, item_id)
-        VALUES (%s, %s)
-    """, (user_id, item_id))
+# Batch save/unsave: JSON {"item_ids": [...]} or repeated item_ids form fields
+def saved_items_batch(change):
+    if request.is_json:
+        values = (request.get_json(silent=True) or {}).get('item_ids')
+    else:
+        values = request.form.getlist('item_ids')
+    try:
+        item_ids = parse_item_ids(values)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    user_id = session['user_id']
+    conn = get_db()
+    cursor = conn.cursor()
+    changed = change(cursor, user_id, item_ids)
     conn.commit()
     cursor.close()
-    conn.close()
+    if changed:
+        invalidate_saved(user_id)
+    return jsonify({'status': 'success', 'requested': len(item_ids), 'changed': changed})
 
-    return jsonify({'status': 'success', 'message': 'Item saved successfully.'})
+@app.route('/api/saved_items', methods=['GET'])
+@login_required
+def api_saved_items():
+    return jsonify({'item_ids': sorted(get_saved_ids(session['user_id']))})
 
+@app.route('/api/saved_items/save', methods=['POST'])
+@login_required
+def api_save_items():
+    return saved_items_batch(save_items)
+
+@app.route('/api/saved_items/remove', methods=['POST'])
+@login_required
+def api_remove_saved_items():
+    return saved_items_batch(remove_items)
 
 
+SAVED_ITEMS_SQL = (
+    f"SELECT {', '.join(f'items.{column.strip()}' for column in GRID_COLUMNS.split(','))} FROM items "
+    "JOIN saved_items ON items.id = saved_items.item_id "
+    "WHERE saved_items.user_id = %s"
+)
+
 @app.route('/saved_items')
 def saved_items():
     user_id = session.get('user_id')
     if not user_id:
         return redirect(url_for('login'))  # Redirect if user not logged in
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT items.* FROM items
-        JOIN saved_items ON items.id = saved_items.item_id
-        WHERE saved_items.user_id = %s
-    """, (user_id,))
-    saved_items = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    return render_template('saved_items.html', saved_items=saved_items)
+    saved_items = db.stream_query(SAVED_ITEMS_SQL, (user_id,))
+    return stream_page('saved_items.html', saved_items=saved_items)
 
 
 @app.route('/remove_saved_item/<int:item_id>', methods=['POST'])
@@ -432,113 +691,90 @@ def remove_saved_item(item_id):
     if not user_id:
         return jsonify({'status': 'error', 'message': 'You must be logged in to remove items.'})
 
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
-        # Check if the item exists
-        cursor.execute("SELECT 1 FROM saved_items WHERE user_id = %s AND item_id = %s", (user_id, item_id))
-        item_exists = cursor.fetchone()
-
-        if not item_exists:
-            return jsonify({'status': 'error', 'message': 'The item does not exist in your saved list.'})
-
-        # Remove the item
-        cursor.execute("DELETE FROM saved_items WHERE user_id = %s AND item_id = %s", (user_id, item_id))
+        # The DELETE's row count says whether it was saved; no separate check
+        removed = remove_items(cursor, user_id, [item_id])
         conn.commit()
-
-        # Explicitly return success
-        return jsonify({'status': 'success', 'message': 'Item removed from your saved list.'})
     except Exception as e:
-        print(f"Error occurred: {e}")  # Debugging
+        app.logger.exception("Error removing saved item %s", item_id)
         return jsonify({'status': 'error', 'message': 'An unexpected error occurred while removing the item.'})
     finally:
         cursor.close()
-        conn.close()
-
-
-
 
+    if not removed:
+        return jsonify({'status': 'error', 'message': 'The item does not exist in your saved list.'})
+    invalidate_saved(user_id)
+    return jsonify({'status': 'success', 'message': 'Item removed from your saved list.'})
 
 
 @app.route('/adminresponse', methods=['GET'])
 def admin_response():
-    """Renders the admin page with the list of proofs."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("SELECT * FROM handle_request")
-        columns = [column[0] for column in cursor.description]  # Get column names
-        requests = [dict(zip(columns, row)) for row in cursor.fetchall()]  # Map rows to dictionaries
-        
-        print("Fetched data:", requests)  # Debugging line to check what data is returned
-        
-        return render_template('adminresponse.html', requests=requests)
-    except Exception as e:
-        flash(f"Error retrieving data: {e}", "danger")
-        return redirect(url_for('admin_response'))
-    finally:
-        cursor.close()
-        conn.close()
-
-
-
-
-
-@app.route('/confirm_request/<string:reference_type>', methods=['POST'])
-def confirm_request(reference_type):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Renders the admin review queue: one page of proofs, pending first."""
+    status = request.args.get('status', 'all')
+    if status not in STATUSES:
+        status = 'all'
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
 
+    current_cursor = request.args.get('cursor')
     try:
-        # Update the status to 'Confirmed' in the handle_request table
-        cursor.execute("UPDATE handle_request SET status = %s WHERE reference_type = %s", ('Confirmed', reference_type))
-        # Log the status change in the status_history table
-        cursor.execute(
-            "INSERT INTO status_history (reference_type, status) VALUES (%s, %s)",
-            (reference_type, 'Confirmed')
-        )
-        conn.commit()
-        flash(f"Request with reference type {reference_type} has been confirmed.", "success")
-    except Exception as e:
-        conn.rollback()
-        flash(f"Error updating status: {e}", "danger")
+        requests, next_cursor = get_queue_page(cursor, status, current_cursor, app.config['ADMIN_PAGE_SIZE'])
+        pending_count = count_pending(cursor)
+    except ValueError:
+        abort(400)
     finally:
         cursor.close()
-        conn.close()
 
-    return redirect(url_for('admin_response'))
+    return render_template('adminresponse.html', requests=requests, next_cursor=next_cursor,
+                           current_cursor=current_cursor, status=status, statuses=STATUSES, pending_count=pending_count)
 
 
-@app.route('/reject_request/<string:reference_type>', methods=['POST'])
-def reject_request(reference_type):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
+# Confirm or reject one request, or many at once from the queue's checkboxes
+def update_request_status(reference_types, status):
     try:
-        # Update the status to 'Rejected' in the handle_request table
-        cursor.execute("UPDATE handle_request SET status = %s WHERE reference_type = %s", ('Rejected', reference_type))
-        # Log the status change in the status_history table
-        cursor.execute(
-            "INSERT INTO status_history (reference_type, status) VALUES (%s, %s)",
-            (reference_type, 'Rejected')
-        )
-        conn.commit()
-        flash(f"Request with reference type {reference_type} has been rejected.", "success")
+        changed = set_request_status(get_db(), reference_types, status)
     except Exception as e:
-        conn.rollback()
         flash(f"Error updating status: {e}", "danger")
-    finally:
-        cursor.close()
-        conn.close()
-
-    return redirect(url_for('admin_response'))
+        return
+    broker = status_events.get_broker()
+    for reference_type in changed:
+        broker.publish(reference_type, status)
+    if len(reference_types) == 1 and changed:
+        flash(f"Request with reference type {changed[0]} has been {status.lower()}.", "success")
+    else:
+        flash(f"{len(changed)} request(s) {status.lower()}.", "success")
 
 
+def redirect_to_queue():
+    return redirect(url_for('admin_response', status=request.form.get('status') or None))
 
 
+@app.route('/confirm_request/<string:reference_type>', methods=['POST'])
+def confirm_request(reference_type):
+    update_request_status([reference_type], 'Confirmed')
+    return redirect_to_queue()
 
 
+@app.route('/reject_request/<string:reference_type>', methods=['POST'])
+def reject_request(reference_type):
+    update_request_status([reference_type], 'Rejected')
+    return redirect_to_queue()
+
+
+@app.route('/bulk_update_requests', methods=['POST'])
+def bulk_update_requests():
+    statuses = {'confirm': 'Confirmed', 'reject': 'Rejected'}
+    action = request.form.get('action')
+    reference_types = request.form.getlist('reference_types')
+    if action not in statuses:
+        abort(400)
+    if not reference_types:
+        flash("No requests selected.", "warning")
+    else:
+        update_request_status(reference_types, statuses[action])
+    return redirect_to_queue()
 
 
 @app.route('/submit_proof', methods=['POST'])
@@ -559,12 +795,17 @@ def submit_proof():
         flash("Screenshot is required. Please upload a screenshot of the payment.", "danger")
         return redirect(url_for('item_detail', item_id=item_id))
 
-    # Process the screenshot and save it
-    file_path = f"static/uploads/{screenshot_file.filename}"
-    screenshot_file.save(file_path)
+    if not allowed_upload(screenshot_file):
+        flash("The screenshot must be a PNG, JPG or GIF image.", "danger")
+        return redirect(url_for('item_detail', item_id=item_id))
+
+    # Store the screenshot by content hash so same-named uploads can't overwrite each other
+    store = app.extensions['blob_store']
+    with metrics.timed('upload'):
+        file_path = store.put(screenshot_file, screenshot_file.filename)
 
     # Insert proof of payment
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         query = """
@@ -572,6 +813,7 @@ def submit_proof():
         VALUES (%s, %s, %s, %s, %s, %s)
         """
         cursor.execute(query, (sender_name, sender_number, reference_type, file_path, 'Pending', item_name))
+        add_refs(cursor, store, 'proof', cursor.lastrowid, [file_path])
         conn.commit()
         flash("Proof of payment has been successfully submitted. Your request is now pending approval.", "success")
     except Exception as e:
@@ -579,21 +821,14 @@ def submit_proof():
         flash(f"Error while submitting proof of payment: {e}", "danger")
     finally:
         cursor.close()
-        conn.close()
 
     return redirect(url_for('item_detail', item_id=item_id))
 
 
 
 
-@app.route('/check_status')
-def check_status():
-    reference_type = request.args.get('referenceType')
-
-    if not reference_type:
-        return jsonify({"error": "Reference type is required."}), 400
-
-    conn = get_db_connection()
+def get_request_status(reference_type):
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
 
     # Query the database for the reference type
@@ -603,19 +838,81 @@ def check_status():
     
     record = cursor.fetchone()
     cursor.close()
-    conn.close()
+    return record['status'] if record else None
+
+
+# Long-poll with ?wait=<seconds>: a pending request answers as soon as an admin decides it.
+# The wait is capped (a few seconds on threaded workers), and when too many clients are
+# already waiting the current status is returned straight away.
+@app.route('/check_status')
+def check_status():
+    reference_type = request.args.get('referenceType')
+
+    if not reference_type:
+        return jsonify({"error": "Reference type is required."}), 400
+
+    wait = min(request.args.get('wait', 0, type=float), status_events.max_wait())
+    broker = status_events.get_broker()
+    # Subscribe before reading so a change made in between isn't missed
+    subscription = None
+    if wait > 0:
+        subscription = broker.subscribe(reference_type, limit=app.config['STATUS_EVENTS_MAX_WAITING'])
+    try:
+        status = get_request_status(reference_type)
+        if status == 'Pending' and subscription is not None:
+            # Give the connection back to the pool while waiting
+            db.release_db()
+            status = subscription.get(timeout=wait) or status
+    finally:
+        if subscription is not None:
+            broker.unsubscribe(subscription)
 
-    if record:
-        return jsonify({"status": record['status']})
+    if status:
+        return jsonify({"status": status})
     return jsonify({"error": "Reference type not found."}), 404
 
 
+# Server-sent events: the current status, then each change pushed by confirm/reject.
+# Only served by cooperative workers (see status_events.init_app); clients fall back to
+# long-polling /check_status on a 503.
+@app.route('/status_events')
+def status_stream():
+    reference_type = request.args.get('referenceType')
 
+    if not reference_type:
+        return jsonify({"error": "Reference type is required."}), 400
+
+    broker = status_events.get_broker()
+    subscription = None
+    if app.config['STATUS_EVENTS_STREAMING']:
+        subscription = broker.subscribe(reference_type, limit=app.config['STATUS_EVENTS_MAX_WAITING'])
+    if subscription is None:
+        unavailable = {"error": "Live status updates are unavailable; poll /check_status."}
+        return jsonify(unavailable), 503, {'Retry-After': '5'}
+    try:
+        status = get_request_status(reference_type)
+    except Exception:
+        broker.unsubscribe(subscription)
+        raise
+    initial = {"status": status} if status else {"error": "Reference type not found."}
+
+    # Not wrapped in stream_with_context: the app context (and its pooled connection)
+    # is torn down before streaming starts, so an open stream holds no DB connection
+    response = Response(
+        status_events.stream_status(broker, subscription, initial,
+                                    app.config['STATUS_EVENTS_TIMEOUT'], app.config['STATUS_EVENTS_HEARTBEAT']),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Also drop the subscription if the client goes away before the stream starts
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    return response
 
 
 @app.route('/proceed_purchase/<int:item_id>', methods=['POST'])
 def proceed_purchase(item_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
     
     cursor.execute("""
@@ -627,7 +924,6 @@ def proceed_purchase(item_id):
     
     item = cursor.fetchone()
     cursor.close()
-    conn.close()
 
     if item:
         buyer_name = "John Doe"  # Replace with session/user data if available
@@ -643,6 +939,14 @@ def proceed_purchase(item_id):
         return "Item not found", 404
 
 
+def too_many_attempts(action, retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    return f"Too many {action} attempts. Please try again in {seconds} seconds.", 429, {'Retry-After': str(seconds)}
+
+# Every password-hashing slot is taken: ask the client to come back rather than queue
+def server_busy():
+    return "The server is busy. Please try again shortly.", 503, {'Retry-After': '1'}
+
 # Route for login
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -653,27 +957,39 @@ def login():
         if not email or not password:  # Check for missing email or password
             return "Missing email or password", 400  # Return an informative error
 
-        conn = get_db_connection()
+        # Throttle by client and by account before any database or hashing work
+        retry_after = check_limits(('login_ip', request.remote_addr), ('login_email', email.strip().lower()))
+        if retry_after is not None:
+            metrics.count('marketplace_login_attempts_total', result='limited')
+            return too_many_attempts("login", retry_after)
+
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
 
         try:
             # Query to check for the user's email
             cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
             user_data = cursor.fetchone()
+            cursor.close()
+            # Release the connection while the hash is checked
+            db.release_db()
 
-            # Validate user and password
-            if user_data and check_password_hash(user_data['password'], password):  # Use hashed password check
-                user = User(user_data['id'], user_data['username'], user_data['email'])  # Create User object
+            # Validate user and password; the hash runs on the bounded hashing pool
+            if user_data and get_hasher().run(check_password_hash, user_data['password'], password):
+                user = User(user_data['id'], user_data['username'], user_data['email'],
+                            user_data.get('profile_picture'))  # Create User object
                 login_user(user)  # Log in the user with Flask-Login
                 session['user_id'] = user.id  # Store user ID in session
+                metrics.count('marketplace_login_attempts_total', result='success')
                 return redirect(url_for('main_index'))  # Redirect to main_index on successful login
 
+            metrics.count('marketplace_login_attempts_total', result='invalid')
             return "Invalid email or password", 401  # Handle invalid login
+        except HasherBusy:
+            metrics.count('marketplace_login_attempts_total', result='busy')
+            return server_busy()
         except Exception as e:
             return f"An error occurred: {e}", 500  # Handle unexpected errors
-        finally:
-            cursor.close()
-            conn.close()  # Ensure the database connection is closed
 
     # Render the login form for GET requests
     return render_template('homepage.html')
@@ -696,8 +1012,12 @@ def register():
         if password != confirm_password:
             return "Passwords do not match. Please try again."
 
+        retry_after = check_limits(('register_ip', request.remote_addr), ('register_email', email.strip().lower()))
+        if retry_after is not None:
+            return too_many_attempts("sign-up", retry_after)
+
         # Connect to the database
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
 
         # Check if the username or email already exists
@@ -705,15 +1025,18 @@ def register():
         if cursor.fetchone():
             return "Username or email already exists. Please try another."
 
-        # Hash the password and insert the new user into the database
-        hashed_password = generate_password_hash(password)
+        # Hash the password (on the bounded hashing pool) and insert the new user into the database
+        try:
+            hashed_password = get_hasher().run(generate_password_hash, password)
+        except HasherBusy:
+            cursor.close()
+            return server_busy()
         cursor.execute(
             "INSERT INTO users (first_name, last_name, username, email, password) VALUES (%s, %s, %s, %s, %s)",
             (first_name, last_name, username, email, hashed_password)
         )
         conn.commit()
         cursor.close()
-        conn.close()
 
         # Redirect to the login page upon successful registration
         return redirect(url_for('login'))
@@ -731,20 +1054,29 @@ def logout():
     return redirect(url_for('homepage'))  # Redirect to the homepage
 
 # User loader function for Flask-Login
+# Users are cached per process so authenticated requests skip the users query;
+# entries are keyed by the user's cache version, which profile edits bump
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
+    key = f"{user_id}:{get_cache().version(f'user:{user_id}')}"
+    user_cache = app.extensions['user_cache']
+    user = user_cache.get(key)
+    if user is not None:
+        return user
+
+    conn = get_db()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+    cursor.execute("SELECT id, username, email, profile_picture FROM users WHERE id = %s", (user_id,))
     user_data = cursor.fetchone()
     cursor.close()
-    conn.close()
     if user_data:
-        return User(user_data['id'], user_data['username'], user_data['email'])
+        user = User(user_data['id'], user_data['username'], user_data['email'], user_data['profile_picture'])
+        user_cache.set(key, user)
+        return user
     return None
 
-# Ensure to create the items table when the application starts
-create_items_table()
+def invalidate_user(user_id):
+    get_cache().bump(f'user:{user_id}')
 
 @app.route('/post_item', methods=['GET', 'POST'])
 @login_required
@@ -758,33 +1090,64 @@ def post_item():
         meetup_place = request.form['meetup_place']
         seller_phone = request.form['seller_phone']
 
-        # Handle Grid Image upload
+        # Collect the grid image and detail images (multiple) that passed validation
         grid_image = request.files['grid_image']
-        grid_image_url = None
-        if grid_image and allowed_file(grid_image.filename):
-            upload_result = cloudinary.uploader.upload(grid_image)
-            grid_image_url = upload_result['secure_url']
-
-        # Handle Detail Image uploads (multiple images)
-        detail_images = request.files.getlist('detail_images')
-        detail_image_urls = []
-
-        for detail_image in detail_images:
-            if detail_image and allowed_file(detail_image.filename):
-                upload_result = cloudinary.uploader.upload(detail_image)
-                detail_image_urls.append(upload_result['secure_url'])
+        if not (grid_image and allowed_upload(grid_image)):
+            grid_image = None
+        detail_images = [f for f in request.files.getlist('detail_images') if f and allowed_upload(f)]
+
+        if app.config['UPLOAD_IN_BACKGROUND']:
+            # Accept the listing now; the upload queue fills in the image URLs when it finishes
+            with metrics.timed('upload'):
+                grid_path = spool_files([grid_image])[0] if grid_image else None
+                detail_paths = spool_files(detail_images)
+            grid_image_url, detail_image_urls = None, []
+            detail_rows = []
+        else:
+            originals = ([grid_image] if grid_image else []) + detail_images
+
+            # Upload every image concurrently instead of one round trip after another
+            with metrics.timed('upload'):
+                urls = app.extensions['uploader'].upload_many(originals)
+            # Resized WebP/AVIF copies for srcset are made by the upload queue afterwards
+            # (see images.py); pages show the originals until they are ready
+            grid_path = spool_files([grid_image])[0] if grid_image else None
+            detail_paths = spool_files(detail_images)
+            # Don't publish a listing with missing pictures; the seller can submit again.
+            # Files that did upload have no references and are removed by blob GC.
+            if None in urls:
+                for path in ([grid_path] if grid_path else []) + detail_paths:
+                    os.remove(path)
+                flash("Some images could not be uploaded. Please try again.", "danger")
+                return render_template('post_item.html'), 502
+            grid_image_url = urls.pop(0) if grid_image else None
+            with metrics.timed('images'):
+                detail_rows = [(url,) + image_size(f) for f, url in zip(detail_images, urls)]
+            detail_image_urls = [row[0] for row in detail_rows]
 
         # Save item to the database
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
+        # grid_variants stays NULL until the upload queue has made them
         cursor.execute(''' 
-            INSERT INTO items (name, price, description, quality, category, meetup_place, seller_phone, grid_image, detail_images, user_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO items (name, price, description, quality, category, meetup_place, seller_phone, grid_image, user_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         ''', (item_name, item_price, item_desc, item_quality, item_category, meetup_place, seller_phone, 
-              grid_image_url, ','.join(detail_image_urls), session.get('user_id')))
+              grid_image_url, session.get('user_id')))
+        item_id = cursor.lastrowid
+        adjust_facets(cursor, [(item_category, item_quality, item_price, 1)])
+        save_item_images(cursor, item_id, detail_rows)
+        add_refs(cursor, app.extensions['blob_store'], 'item', item_id,
+                 [grid_image_url] + detail_image_urls)
         conn.commit()
         cursor.close()
-        conn.close()
+        invalidate_items(item_id, facets=True)
+
+        if app.config['UPLOAD_IN_BACKGROUND']:
+            if grid_path or detail_paths:
+                app.extensions['upload_queue'].submit(item_id, grid_path, detail_paths)
+        elif grid_path or detail_paths:
+            app.extensions['upload_queue'].submit_variants(item_id, grid_path, enumerate(detail_paths))
 
         return redirect(url_for('main_index'))
 
@@ -801,60 +1164,99 @@ def update_profile_picture():
     if file.filename == '':
         return jsonify({'success': False, 'error': 'No file selected'})
 
-    if file and allowed_file(file.filename):
+    if file and allowed_upload(file):
         try:
             # Upload to Cloudinary with specific options
-            upload_result = cloudinary.uploader.upload(
-                file,
-                folder="profile_pictures",  # Store in a specific folder
-                transformation=[
-                    {'width': 300, 'height': 300, 'crop': 'fill'},  # Resize and crop to square
-                    {'quality': 'auto:good'}  # Optimize quality
-                ]
-            )
+            with metrics.timed('upload'):
+                profile_picture_url = app.extensions['uploader'].upload_one(
+                    file,
+                    folder="profile_pictures",  # Store in a specific folder
+                    transformation=[
+                        {'width': 300, 'height': 300, 'crop': 'fill'},  # Resize and crop to square
+                        {'quality': 'auto:good'}  # Optimize quality
+                    ]
+                )
             
             # Update database with the new profile picture URL
-            conn = get_db_connection()
+            conn = get_db()
             cursor = conn.cursor()
             
             cursor.execute(
                 "UPDATE users SET profile_picture = %s WHERE id = %s",
-                (upload_result['secure_url'], session['user_id'])
+                (profile_picture_url, session['user_id'])
             )
+            # The new picture replaces the old one in the blob store's reference counts
+            store = app.extensions['blob_store']
+            released = release_refs(cursor, 'user', session['user_id'])
+            add_refs(cursor, store, 'user', session['user_id'], [profile_picture_url])
             
             conn.commit()
+
+            invalidate_user(session['user_id'])
+            invalidate_seller_items(cursor, session['user_id'])
             cursor.close()
-            conn.close()
+            collect_garbage(conn, store, [p for p in released if p != store.relpath_from_url(profile_picture_url)],
+                            grace=app.config['BLOB_GC_GRACE'])
             
             # Return the new profile picture URL
             return jsonify({
                 'success': True,
-                'profile_picture_url': upload_result['secure_url']
+                'profile_picture_url': profile_picture_url
             })
             
         except Exception as e:
-            print(f"Error uploading profile picture: {str(e)}")  # Debug log
+            app.logger.exception("Error uploading profile picture")
             return jsonify({'success': False, 'error': str(e)})
     
     return jsonify({'success': False, 'error': 'Invalid file type'})
 
-# Add this function to create/update the users table
-def update_users_table():
-    conn = get_db_connection()
+# Bulk import of the seller's listings from a CSV or JSONL file; returns a per-row error report
+@app.route('/import_items', methods=['POST'])
+@login_required
+def import_items():
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'success': False, 'error': 'No file selected'}), 400
+    fmt = bulk_items.detect_format(file.filename, request.form.get('format'))
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'error': 'Format must be csv or jsonl'}), 400
+
+    # Imports run on the background upload workers; referenced images are linked as given
+    # (re-hosting them is only offered by `flask import-items --fetch-images`)
+    path = spool_files([file])[0]
+    conn = get_db()
     cursor = conn.cursor()
-    try:
-        # Add profile_picture column if it doesn't exist
-        cursor.execute("""
-            ALTER TABLE users 
-            ADD COLUMN IF NOT EXISTS profile_picture VARCHAR(255)
-        """)
-        conn.commit()
-    except Exception as e:
-        print(f"Error updating users table: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+    cursor.execute("INSERT INTO import_jobs (user_id) VALUES (%s)", (session['user_id'],))
+    job_id = cursor.lastrowid
+    conn.commit()
+    cursor.close()
+    app.extensions['upload_queue'].submit_job(bulk_items.run_import_job, app, job_id, path, fmt, session['user_id'],
+                                              lambda: invalidate_items(facets=True))
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('import_status', job_id=job_id)}), 202
+
+@app.route('/import_items/<int:job_id>', methods=['GET'])
+@login_required
+def import_status(job_id):
+    cursor = get_db().cursor()
+    job = bulk_items.load_import_job(cursor, job_id, session['user_id'])
+    cursor.close()
+    if job is None:
+        return jsonify({'success': False, 'error': 'Import not found'}), 404
+    return jsonify({'success': True, **job})
+
+# The seller's listings as a CSV, JSONL or JSON download, streamed as rows are read
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'json': 'application/json'}
 
-# Call this function when your app starts
-# Add this near the bottom of your file, before the if __name__ == '__main__': line
-update_users_table()
\ No newline at end of file
+@app.route('/export_items', methods=['GET'])
+@login_required
+def export_items():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_MIMETYPES:
+        abort(400)
+    # The generator takes its own pooled connection, so it runs after this request's is released
+    rows = bulk_items.export_items(db.get_pool(), fmt, session['user_id'],
+                                   chunk_size=app.config['DB_STREAM_FETCH_SIZE'],
+                                   flush_size=app.config['STREAM_CHUNK_SIZE'])
+    return Response(rows, mimetype=EXPORT_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=items.{fmt}'})
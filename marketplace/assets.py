@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.sessions import SecureCookieSessionInterface
+
+# Fingerprinted copies, their precompressed variants and the manifest live here (under static/)
+BUILD_DIR = 'dist'
+
+# Only the site's own assets are fingerprinted; uploads are user content
+ASSET_EXTENSIONS = {'.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp', '.woff', '.woff2'}
+EXCLUDED_DIRS = {BUILD_DIR, 'uploads', 'screenshots'}
+
+# Text formats worth precompressing; images and fonts are already compressed
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico'}
+
+# Preferred first when the client accepts several
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+def brotli_compress(data):
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+# Static files to fingerprint, as paths relative to the static folder
+def source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
+        for name in files:
+            if os.path.splitext(name)[1].lower() in ASSET_EXTENSIONS:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+# Copy each asset to dist/<name>.<hash><ext> with .gz/.br variants where they are smaller,
+# and write the manifest (logical name -> fingerprinted name). Outputs that already exist
+# are kept, as are those of earlier builds, so pages that still reference them keep working.
+def build_assets(static_folder):
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    manifest = {}
+    for name in source_files(static_folder):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+        stem, extension = os.path.splitext(name)
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = f"{BUILD_DIR}/{stem}.{digest}{extension}"
+        manifest[name] = hashed
+
+        path = os.path.join(static_folder, hashed)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if extension.lower() in COMPRESSIBLE:
+            for suffix, compressed in (('.gz', gzip.compress(data, 9, mtime=0)), ('.br', brotli_compress(data))):
+                if compressed is not None and len(compressed) < len(data) * 0.9:
+                    write_atomic(path + suffix, compressed)
+        # The plain copy goes last: its presence marks the asset as fully built
+        write_atomic(path, data)
+
+    if manifest != load_manifest(static_folder):
+        os.makedirs(build_root, exist_ok=True)
+        write_atomic(os.path.join(build_root, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Remove fingerprinted files that the current manifest no longer references
+def clean_assets(static_folder, manifest):
+    keep = {f'{BUILD_DIR}/manifest.json'}
+    for hashed in manifest.values():
+        keep.update(hashed + suffix for suffix in ('', '.gz', '.br'))
+    removed = []
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    for root, _, files in os.walk(build_root):
+        for name in files:
+            path = os.path.join(root, name)
+            relpath = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if relpath not in keep:
+                os.remove(path)
+                removed.append(relpath)
+    return removed
+
+
+# url_for('static', filename='style.css') -> /static/dist/style.<hash>.css
+def fingerprint_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        hashed = current_app.extensions['assets'].get(values['filename'])
+        if hashed is not None:
+            values['filename'] = hashed
+
+
+def immutable(filename):
+    if filename.startswith(BUILD_DIR + '/'):
+        return True
+    # Uploads are stored under their content hash too
+    store = current_app.extensions.get('blob_store')
+    return store is not None and store.url_pattern.match('/static/' + filename) is not None
+
+
+# Replaces Flask's static view: fingerprinted files get far-future immutable caching and
+# the smallest precompressed variant the client accepts; other files are served as before
+def serve_static(filename):
+    app = current_app
+    if not immutable(filename):
+        return app.send_static_file(filename)
+
+    max_age = app.config['ASSETS_MAX_AGE']
+    encoding = None
+    if filename.startswith(BUILD_DIR + '/'):
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                encoding = name
+                break
+    if encoding is None:
+        response = send_from_directory(app.static_folder, filename, max_age=max_age)
+    else:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(app.static_folder, filename + dict(ENCODINGS)[encoding],
+                                       mimetype=mimetype, max_age=max_age)
+        response.headers['Content-Encoding'] = encoding
+    if filename.startswith(BUILD_DIR + '/'):
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# Static responses never use the session, but Flask-Login's after_request handler reads it,
+# which would add "Vary: Cookie" and keep browsers and CDNs from sharing cached copies
+class StaticSessionInterface(SecureCookieSessionInterface):
+    def save_session(self, app, session, response):
+        if request.endpoint == 'static':
+            return
+        super().save_session(app, session, response)
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_MAX_AGE', int(os.environ.get('ASSETS_MAX_AGE', ONE_YEAR)))
+
+    # Workers only read the manifest; `flask build-assets` writes it once per deploy (before
+    # the server starts), so workers never race each other writing static/dist. Without a
+    # manifest, url_for('static') falls back to the plain, revalidated URLs.
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    app.url_defaults(fingerprint_url)
+    app.view_functions['static'] = serve_static
+    if type(app.session_interface) is SecureCookieSessionInterface:
+        app.session_interface = StaticSessionInterface()
+
+    @app.cli.command('build-assets')
+    @click.option('--clean', is_flag=True, help='Remove fingerprinted files from earlier builds.')
+    def build_assets_command(clean):
+        """Fingerprint and precompress static assets and write the manifest."""
+        manifest = build_assets(app.static_folder)
+        app.extensions['assets'] = manifest
+        for name, hashed in sorted(manifest.items()):
+            click.echo(f"{name} -> {hashed}")
+        if clean:
+            removed = clean_assets(app.static_folder, manifest)
+            click.echo(f"{len(removed)} stale files removed")
@@ -0,0 +1,358 @@
+import io
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+import click
+from werkzeug.security import generate_password_hash
+
+from db import get_db, get_pool
+from facets import rebuild_facets
+from uploads import LocalBackend
+
+CATEGORIES = ['clothes', 'school_supplies', 'office_equipment', 'devices', 'bags', 'electronics', 'shoes',
+              'miscellaneous']
+QUALITIES = ['new', 'used_like_new', 'used_good', 'used_fair']
+WORDS = ['calculator', 'backpack', 'laptop', 'uniform', 'notebook', 'sneakers', 'monitor', 'keyboard', 'jacket',
+         'stapler', 'headphones', 'charger', 'printer', 'tumbler', 'textbook', 'lamp', 'chair', 'mouse', 'tablet',
+         'boots', 'hoodie', 'scientific', 'wireless', 'leather', 'vintage', 'black', 'blue', 'small', 'large']
+
+# Seeded users all share this password so HTTP runs can log in as any of them
+BENCH_PASSWORD = 'benchmark'
+BENCH_EMAIL = 'bench{}@example.com'
+
+PERCENTILES = (50, 95, 99)
+
+
+def insert_batches(conn, sql, rows, batch):
+    cursor = conn.cursor()
+    for start in range(0, len(rows), batch):
+        cursor.executemany(sql, rows[start:start + batch])
+        conn.commit()
+    cursor.close()
+
+
+# Fill the catalog with deterministic fake data; returns the number of rows added per table
+def seed(conn, items, users, saved, requests, batch=1000, seed=42):
+    rng = random.Random(seed)
+    password = generate_password_hash(BENCH_PASSWORD)
+    run = uuid.uuid4().hex[:6]
+
+    insert_batches(conn, "INSERT INTO users (first_name, last_name, username, email, password) "
+                         "VALUES (%s, %s, %s, %s, %s)",
+                   [('Bench', str(n), f'bench_{run}_{n}', BENCH_EMAIL.format(f'{run}_{n}'), password)
+                    for n in range(users)], batch)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE email LIKE %s", ('bench%@example.com',))
+    user_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    # Items are generated in slices so a 1M-row catalog never sits in memory at once
+    for start in range(0, items, batch * 10):
+        rows = []
+        for _ in range(min(batch * 10, items - start)):
+            name = ' '.join(rng.sample(WORDS, 3)).title()
+            rows.append((
+                name, f"{rng.uniform(10, 20000):.2f}", f"{name} in {rng.choice(QUALITIES).replace('_', ' ')} "
+                f"condition. " + ' '.join(rng.choices(WORDS, k=20)),
+                rng.choice(QUALITIES), rng.choice(CATEGORIES), 'Main gate', '09170000000',
+                f"https://picsum.photos/seed/{rng.randrange(10 ** 6)}/640/480", rng.choice(user_ids),
+            ))
+        insert_batches(conn, "INSERT INTO items (name, price, description, quality, category, meetup_place, "
+                             "seller_phone, grid_image, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                       rows, batch)
+
+    low, high = item_id_range(conn)
+    if high:
+        insert_batches(conn, "INSERT IGNORE INTO saved_items (user_id, item_id) VALUES (%s, %s)",
+                       [(rng.choice(user_ids), rng.randint(low, high)) for _ in range(saved)], batch)
+    insert_batches(conn, "INSERT INTO handle_request (sender_name, sender_number, reference_type, screenshot, "
+                         "status, item_name) VALUES (%s, %s, %s, %s, %s, %s)",
+                   [(f'Bench {n}', '09170000000', f'BENCH-{run}-{n}', None,
+                     rng.choice(['Pending', 'Confirmed', 'Rejected']), rng.choice(WORDS).title())
+                    for n in range(requests)], batch)
+    return {'users': users, 'items': items, 'saved_items': saved, 'handle_request': requests}
+
+
+def item_id_range(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id) FROM items")
+    low, high = cursor.fetchone()
+    cursor.close()
+    return low or 0, high or 0
+
+
+def sample_png():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), (209, 0, 36)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+# Route scenarios: name -> (method, path, form builder or None). Paths and forms are
+# drawn from the seeded data so each request hits a different row.
+def build_scenarios(low, high, references, png):
+    def item_id(rng):
+        return rng.randint(low, high) if high else 1
+
+    def post_form(rng):
+        return {
+            'item_name': ' '.join(rng.sample(WORDS, 3)).title(), 'item_price': '199.00',
+            'item_desc': 'Benchmark listing', 'item_quality': rng.choice(QUALITIES),
+            'item_category': rng.choice(CATEGORIES), 'meetup_place': 'Main gate', 'seller_phone': '09170000000',
+            'grid_image': ('bench.png', png), 'detail_images': ('bench.png', png),
+        }
+
+    return {
+        'index': ('GET', lambda rng: '/', None),
+        'main_index': ('GET', lambda rng: '/main_index', None),
+        'search': ('GET', lambda rng: '/search?' + urllib.parse.urlencode({'query': rng.choice(WORDS)}), None),
+        'filter': ('GET', lambda rng: f'/filter/{rng.choice(CATEGORIES)}', None),
+        'item_detail': ('GET', lambda rng: f'/item/{item_id(rng)}', None),
+        'save_item': ('POST', lambda rng: f'/save_item/{item_id(rng)}', lambda rng: {}),
+        'check_status': ('GET', lambda rng: '/check_status?' + urllib.parse.urlencode(
+            {'referenceType': rng.choice(references) if references else 'BENCH-missing'}), None),
+        'post_item': ('POST', lambda rng: '/post_item', post_form),
+    }
+
+
+# In-process client: the Flask test client, logged in by writing the session directly
+class TestClientDriver:
+    def __init__(self, app, user_id):
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['_user_id'] = str(user_id)
+
+    def request(self, method, path, form):
+        data = None
+        if form is not None:
+            data = {key: (io.BytesIO(value[1]), value[0]) if isinstance(value, tuple) else value
+                    for key, value in form.items()}
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+# HTTP client against a running server, logged in through /login
+class HTTPDriver:
+    def __init__(self, base_url, email):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        self.request('POST', '/login', {'email': email, 'password': BENCH_PASSWORD})
+
+    def request(self, method, path, form):
+        body, headers = None, {}
+        if form is not None:
+            if any(isinstance(value, tuple) for value in form.values()):
+                body, content_type = encode_multipart(form)
+                headers['Content-Type'] = content_type
+            else:
+                body = urllib.parse.urlencode(form).encode()
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def encode_multipart(form):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for key, value in form.items():
+        if isinstance(value, tuple):
+            filename, content = value
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+        else:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+# Send `requests` requests for one scenario from `concurrency` workers; latencies in ms
+def run_scenario(drivers, scenario, requests, seed=0):
+    method, path_for, form_for = scenario
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(index):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + index)
+        driver = drivers[index]
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            path = path_for(rng)
+            form = form_for(rng) if form_for else None
+            start = time.perf_counter()
+            status = driver.request(method, path, form)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status >= 500:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(drivers)) as executor:
+        list(executor.map(worker, range(len(drivers))))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    result = {f'p{pct}': round(percentile(latencies, pct), 2) for pct in PERCENTILES}
+    result.update({'requests': len(latencies), 'errors': errors, 'rps': round(len(latencies) / wall, 1) if wall else 0})
+    return result
+
+
+# Routes whose p95 or throughput got worse than the baseline by more than `tolerance`;
+# a small absolute slack keeps sub-millisecond noise from tripping it
+def compare(results, baseline, tolerance, slack_ms=2.0):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['p95'] > base['p95'] * (1 + tolerance) + slack_ms:
+            regressions.append(f"{name}: p95 {result['p95']}ms vs baseline {base['p95']}ms")
+        if base.get('rps') and result['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rps']} req/s vs baseline {base['rps']} req/s")
+    return regressions
+
+
+# (id, name, description, category) rows for the similar-items benchmark, drawn from a
+# vocabulary of `terms` words with a long-tailed frequency like real listing text
+def fake_item_texts(items, terms=5000, seed=42):
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f"term{n}" for n in range(terms)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    for item_id in range(1, items + 1):
+        name = ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=3)).title()
+        description = ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=20))
+        yield item_id, name, description, rng.choice(CATEGORIES)
+
+
+def init_app(app):
+    @app.cli.command('bench-seed')
+    @click.option('--items', default=10000, help='Items to add (10k-1M).')
+    @click.option('--users', default=1000)
+    @click.option('--saved', default=20000, help='saved_items rows to add.')
+    @click.option('--requests', 'handle_requests', default=5000, help='handle_request rows to add.')
+    @click.option('--batch', default=1000, help='Rows per INSERT batch.')
+    @click.option('--seed', 'rng_seed', default=42, help='Random seed, for reproducible catalogs.')
+    def bench_seed_command(items, users, saved, handle_requests, batch, rng_seed):
+        """Seed the database with a synthetic catalog for benchmarking."""
+        start = time.perf_counter()
+        conn = get_db()
+        counts = seed(conn, items, users, saved, handle_requests, batch, rng_seed)
+        cursor = conn.cursor()
+        rebuild_facets(cursor)
+        conn.commit()
+        cursor.close()
+        app.extensions['cache'].bump('listings', 'facets')
+        click.echo(f"Seeded {counts} in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command('bench-similar')
+    @click.option('--items', default=100000, help='Synthetic items to vectorize.')
+    @click.option('--dimensions', default=None, type=int, help='Vector size; default SIMILAR_ITEMS_DIMENSIONS.')
+    def bench_similar_command(items, dimensions):
+        """Time a similar-items rebuild (vectorize + top-k) on synthetic items, without the database."""
+        from similar import build_vectors, nearest_neighbors
+
+        dimensions = dimensions or app.config['SIMILAR_ITEMS_DIMENSIONS']
+        start = time.perf_counter()
+        ids, matrix = build_vectors(fake_item_texts(items), dimensions)
+        vectorize = time.perf_counter() - start
+        start = time.perf_counter()
+        scored = sum(len(rows) for rows, _, _ in nearest_neighbors(matrix, count=app.config['SIMILAR_ITEMS_COUNT']))
+        neighbors = time.perf_counter() - start
+        click.echo(f"{len(ids)} items, {dimensions} dimensions ({matrix.nbytes / 2 ** 20:.0f}MB matrix)")
+        click.echo(f"vectorize {vectorize:.1f}s, neighbours {neighbors:.1f}s for {scored} items, "
+                   f"total {vectorize + neighbors:.1f}s")
+
+    @app.cli.command('bench')
+    @click.option('--route', 'routes', multiple=True, help='Scenario to run (repeatable); default all.')
+    @click.option('--requests', default=200, help='Requests per route.')
+    @click.option('--concurrency', default=8, help='Concurrent clients.')
+    @click.option('--warmup', default=10, help='Unmeasured requests per route before timing.')
+    @click.option('--url', default=None, help='Benchmark a running server over HTTP instead of in-process '
+                                                     '(post_item only with --route).')
+    @click.option('--baseline', default='benchmark_baseline.json', help='Baseline file to compare against.')
+    @click.option('--save-baseline', is_flag=True, help='Write these results as the new baseline.')
+    @click.option('--tolerance', default=0.2, help='Allowed slowdown before a route is flagged (0.2 = 20%).')
+    @click.option('--seed', 'rng_seed', default=1)
+    def bench_command(routes, requests, concurrency, warmup, url, baseline, save_baseline, tolerance, rng_seed):
+        """Drive the marketplace routes and report p50/p95/p99 latency and throughput."""
+        # Only borrowed for setup, so every pool slot is free while the routes are measured
+        with get_pool().connection() as conn:
+            low, high = item_id_range(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, email FROM users WHERE email LIKE %s LIMIT %s",
+                           ('bench%@example.com', concurrency))
+            accounts = cursor.fetchall()
+            cursor.execute("SELECT reference_type FROM handle_request WHERE reference_type LIKE %s LIMIT 1000",
+                           ('BENCH-%',))
+            references = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        if not accounts:
+            raise click.ClickException("No benchmark users found; run `flask bench-seed` first.")
+
+        scenarios = build_scenarios(low, high, references, sample_png())
+        unknown = set(routes) - set(scenarios)
+        if unknown:
+            raise click.BadParameter(f"Unknown routes: {', '.join(sorted(unknown))}; "
+                                     f"choose from {', '.join(scenarios)}")
+
+        accounts = [accounts[n % len(accounts)] for n in range(concurrency)]
+        if url:
+            drivers = [HTTPDriver(url, email) for _, email in accounts]
+            # The server uploads with its own UPLOAD_BACKEND, so post_item only runs when asked for
+            if not routes:
+                routes = [name for name in scenarios if name != 'post_item']
+        else:
+            # post_item must never push benchmark images to Cloudinary, whatever UPLOAD_BACKEND says
+            app.extensions['uploader'].backend = LocalBackend(app.extensions['blob_store'])
+            drivers = [TestClientDriver(app, user_id) for user_id, _ in accounts]
+
+        results = {}
+        click.echo(f"{'route':<14}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'errors':>8}")
+        for name in routes or scenarios:
+            if warmup:
+                run_scenario(drivers, scenarios[name], warmup, rng_seed)
+            result = results[name] = run_scenario(drivers, scenarios[name], requests, rng_seed)
+            click.echo(f"{name:<14}{result['p50']:>9}{result['p95']:>9}{result['p99']:>9}"
+                       f"{result['rps']:>9}{result['errors']:>8}")
+
+        if save_baseline:
+            with open(baseline, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            click.echo(f"Baseline written to {baseline}")
+            return
+        if os.path.exists(baseline):
+            with open(baseline) as f:
+                regressions = compare(results, json.load(f), tolerance)
+            for regression in regressions:
+                click.echo(f"REGRESSION {regression}", err=True)
+            if regressions:
+                raise SystemExit(1)
+            click.echo(f"No regressions against {baseline}")
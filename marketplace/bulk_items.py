@@ -0,0 +1,481 @@
+import csv
+import io
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import click
+from werkzeug.datastructures import FileStorage
+
+from db import get_db, get_pool, iter_rows
+from facets import adjust_facets
+from images import make_derivatives, collect_variants, variant_urls, image_size
+from storage import add_refs
+from upload_limits import sniff_image_type
+
+# Columns of an import/export file, in CSV header order; detail_images are "|"-separated in CSV
+FIELDS = ['name', 'price', 'description', 'quality', 'category', 'meetup_place', 'seller_phone',
+          'grid_image', 'detail_images']
+QUALITIES = {'new', 'used_like_new', 'used_good', 'used_fair'}
+MAX_PRICE = Decimal('99999999.99')
+MAX_DETAIL_IMAGES = 10
+
+# Per-row errors kept in a report; the counts stay exact past this
+MAX_REPORTED_ERRORS = 1000
+
+
+class RowError(Exception):
+    pass
+
+
+# Yield (line number, row dict) from a CSV or JSONL byte stream without reading it all;
+# a line that can't be parsed yields (line number, RowError) instead
+def parse_rows(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f"invalid JSON: {e}")
+            continue
+        yield line_no, row if isinstance(row, dict) else RowError("expected a JSON object")
+
+
+def detect_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if os.path.splitext(filename or '')[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def required(row, field, max_length):
+    value = str(row.get(field) or '').strip()
+    if not value:
+        raise RowError(f"{field} is required")
+    if len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+# For TEXT columns, whose limit is in bytes: multibyte text fits fewer characters
+def required_text(row, field, max_bytes):
+    value = required(row, field, max_bytes)
+    if len(value.encode('utf-8')) > max_bytes:
+        raise RowError(f"{field} is longer than {max_bytes} bytes")
+    return value
+
+
+def image_url(value):
+    value = str(value or '').strip()
+    if value and not value.startswith(('http://', 'https://', '/static/')):
+        raise RowError(f"unsupported image URL: {value[:100]}")
+    return value or None
+
+
+# Check one row and return it as a dict of clean values, or raise RowError
+def validate_row(row):
+    try:
+        price = Decimal(str(row.get('price', '')).strip())
+    except InvalidOperation:
+        raise RowError("price must be a number")
+    if not (0 <= price <= MAX_PRICE):
+        raise RowError("price is out of range")
+    quality = str(row.get('quality') or '').strip()
+    if quality not in QUALITIES:
+        raise RowError(f"quality must be one of {', '.join(sorted(QUALITIES))}")
+
+    detail_images = row.get('detail_images') or []
+    if isinstance(detail_images, str):
+        detail_images = detail_images.split('|')
+    detail_images = [url for url in (image_url(u) for u in detail_images) if url]
+    if len(detail_images) > MAX_DETAIL_IMAGES:
+        raise RowError(f"at most {MAX_DETAIL_IMAGES} detail images are allowed")
+
+    return {
+        'name': required(row, 'name', 255),
+        'price': price.quantize(Decimal('0.01')),
+        'description': required_text(row, 'description', 65535),
+        'quality': quality,
+        'category': required(row, 'category', 100),
+        'meetup_place': required(row, 'meetup_place', 255),
+        'seller_phone': required(row, 'seller_phone', 15),
+        'grid_image': image_url(row.get('grid_image')),
+        'detail_images': detail_images,
+        'grid_variants': None,
+    }
+
+
+# Refuse URLs whose host resolves to a loopback, private, link-local or otherwise
+# non-public address, so an import file can't make the server fetch internal services
+# (database admin pages, cloud metadata endpoints and the like)
+def check_public_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise RowError(f"unsupported image URL: {url[:100]}")
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                       proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise RowError(f"image host not found: {parts.hostname[:100]}")
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if getattr(address, 'ipv4_mapped', None):
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise RowError(f"image host is not a public address: {parts.hostname[:100]}")
+
+
+# Redirects are followed only to other public addresses
+class PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+IMAGE_OPENER = urllib.request.build_opener(PublicRedirectHandler)
+
+
+# Download a referenced image to a temp file, refusing non-public hosts, anything too
+# large and anything that isn't an image
+def download_image(url, max_size, timeout):
+    check_public_url(url)
+    fd, path = tempfile.mkstemp(prefix='import_')
+    try:
+        with os.fdopen(fd, 'wb') as dst, IMAGE_OPENER.open(url, timeout=timeout) as response:
+            size = 0
+            for chunk in iter(lambda: response.read(64 * 1024), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise RowError(f"image too large: {url[:100]}")
+                dst.write(chunk)
+        with open(path, 'rb') as src:
+            kind = sniff_image_type(FileStorage(stream=src))
+        if kind is None:
+            raise RowError(f"not a PNG/JPG/GIF image: {url[:100]}")
+        # The blob store keeps the file's extension, so give it the sniffed one
+        os.rename(path, f"{path}.{kind}")
+        return f"{path}.{kind}"
+    except Exception:
+        os.remove(path)
+        raise
+
+
+# Bulk importer: validates rows, re-hosts referenced images through a bounded worker pool
+# and inserts each chunk of rows (images with executemany) in its own transaction
+class Importer:
+    def __init__(self, uploader, store, user_id, batch_size=500, fetch_images=False, workers=4,
+                 max_image_size=10 * 1024 * 1024, timeout=30):
+        self.uploader = uploader
+        self.store = store
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.fetch_images = fetch_images
+        self.workers = workers
+        self.max_image_size = max_image_size
+        self.timeout = timeout
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.item_ids = []
+
+    def error(self, line_no, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': message})
+
+    def run(self, conn, rows):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import') as executor:
+            chunk = []
+            for line_no, row in rows:
+                if isinstance(row, RowError):
+                    self.error(line_no, str(row))
+                    continue
+                try:
+                    chunk.append((line_no, validate_row(row)))
+                except RowError as e:
+                    self.error(line_no, str(e))
+                    continue
+                if len(chunk) >= self.batch_size:
+                    self.flush(conn, chunk, executor)
+                    chunk = []
+            if chunk:
+                self.flush(conn, chunk, executor)
+        return self.report()
+
+    def report(self):
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+    def flush(self, conn, chunk, executor):
+        if self.fetch_images:
+            chunk = self.rehost_images(chunk, executor)
+        if not chunk:
+            return
+        cursor = conn.cursor()
+        try:
+            item_ids = self.insert(cursor, chunk)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for line_no, _ in chunk:
+                self.error(line_no, f"batch insert failed: {e}")
+        else:
+            self.imported += len(chunk)
+            self.item_ids.extend(item_ids)
+        finally:
+            cursor.close()
+
+    def insert(self, cursor, chunk):
+        # One INSERT per item so each id comes from its own lastrowid: a multi-row INSERT's ids
+        # needn't be consecutive (innodb_autoinc_lock_mode=2), and guessing them could attach
+        # images to another listing. Still one transaction per chunk.
+        item_ids = []
+        for _, r in chunk:
+            cursor.execute(
+                "INSERT INTO items (name, price, description, quality, category, meetup_place, seller_phone, "
+                "grid_image, grid_variants, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (r['name'], r['price'], r['description'], r['quality'], r['category'], r['meetup_place'],
+                 r['seller_phone'], r['grid_image'], json.dumps(r['grid_variants']) if r['grid_variants'] else None,
+                 self.user_id)
+            )
+            item_ids.append(cursor.lastrowid)
+
+        images = []
+        for item_id, (_, r) in zip(item_ids, chunk):
+            # Re-hosted images are (url, width, height, variants); linked ones are plain URLs
+            detail = [image if isinstance(image, tuple) else (image, None, None, None) for image in r['detail_images']]
+            images.extend((item_id, position, url, width, height, json.dumps(variants) if variants else None)
+                          for position, (url, width, height, variants) in enumerate(detail))
+            add_refs(cursor, self.store, 'item', item_id,
+                     [r['grid_image']] + [url for url, _, _, _ in detail] + variant_urls(r['grid_variants'] or {}) +
+                     [url for _, _, _, variants in detail for url in variant_urls(variants or {})])
+        if images:
+            cursor.executemany(
+                "INSERT INTO item_images (item_id, position, url, width, height, variants) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                images
+            )
+        adjust_facets(cursor, [(r['category'], r['quality'], r['price'], 1) for _, r in chunk])
+        return item_ids
+
+    # Download every image the chunk references (bounded by the pool), then upload them and
+    # the grid derivatives through the uploader; rows whose images fail are reported, not imported
+    def rehost_images(self, chunk, executor):
+        urls = list(dict.fromkeys(
+            url for _, r in chunk for url in [r['grid_image']] + r['detail_images']
+            if url and url.startswith(('http://', 'https://'))
+        ))
+        futures = {url: executor.submit(download_image, url, self.max_image_size, self.timeout) for url in urls}
+        paths, failures = {}, {}
+        for url, future in futures.items():
+            try:
+                paths[url] = future.result()
+            except Exception as e:
+                failures[url] = str(e)
+
+        try:
+            ok_chunk = []
+            for line_no, r in chunk:
+                failed = [failures[u] for u in [r['grid_image']] + r['detail_images'] if u in failures]
+                if failed:
+                    self.error(line_no, f"image download failed: {failed[0]}")
+                else:
+                    ok_chunk.append((line_no, r))
+
+            # Resized variants of every re-hosted image, grid and detail alike
+            sources = list(dict.fromkeys(
+                u for _, r in ok_chunk for u in [r['grid_image']] + r['detail_images'] if u in paths
+            ))
+            derivatives = {url: make_derivatives(paths[url], paths[url]) for url in sources}
+            files = [paths[url] for url in paths] + [f for url in sources for _, _, f in derivatives[url]]
+            uploaded = self.uploader.upload_many(files)
+            hosted = dict(zip(paths, uploaded))
+            variants, offset = {}, len(paths)
+            for url in sources:
+                count = len(derivatives[url])
+                variants[url] = collect_variants(derivatives[url], uploaded[offset:offset + count])
+                offset += count
+
+            result = []
+            for line_no, r in ok_chunk:
+                images = [r['grid_image']] + r['detail_images']
+                if any(u in paths and not hosted.get(u) for u in images):
+                    self.error(line_no, "image upload failed")
+                    continue
+                if r['grid_image'] in paths:
+                    r['grid_variants'] = variants.get(r['grid_image']) or None
+                    r['grid_image'] = hosted[r['grid_image']]
+                r['detail_images'] = [
+                    (hosted[u],) + image_size(paths[u]) + (variants.get(u) or None,) if u in paths else u
+                    for u in r['detail_images']
+                ]
+                result.append((line_no, r))
+            return result
+        finally:
+            for path in paths.values():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# Items with their detail image URLs joined in, one row per item in id order
+def export_query(user_id=None):
+    sql = (
+        "SELECT i.id, i.name, i.price, i.description, i.quality, i.category, i.meetup_place, i.seller_phone, "
+        "i.grid_image, GROUP_CONCAT(ii.url ORDER BY ii.position SEPARATOR '|') AS detail_images "
+        "FROM items i LEFT JOIN item_images ii ON ii.item_id = i.id"
+    )
+    params = ()
+    if user_id is not None:
+        sql += " WHERE i.user_id = %s"
+        params = (user_id,)
+    sql += " GROUP BY i.id ORDER BY i.id"
+    return sql, params
+
+
+# Stream a seller's (or every) listing as CSV, JSONL or a JSON array, reading rows through an
+# unbuffered cursor on its own pooled connection so memory stays flat however many rows there
+# are; output is sent in pieces of about `flush_size` characters
+def export_items(pool, fmt='csv', user_id=None, chunk_size=500, flush_size=16 * 1024):
+    sql, params = export_query(user_id)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        # Long galleries would otherwise be cut at the default 1024 bytes
+        cursor.execute("SET SESSION group_concat_max_len = 65535")
+        cursor.close()
+        buffer = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(FIELDS)
+        elif fmt == 'json':
+            buffer.write('[')
+        separator = '\n'
+        for row in iter_rows(conn, sql, params, chunk_size, dictionary=True):
+            row['price'] = str(row['price'])
+            if fmt == 'csv':
+                writer.writerow([row[field] if row[field] is not None else '' for field in FIELDS])
+            else:
+                row['detail_images'] = row['detail_images'].split('|') if row['detail_images'] else []
+                record = json.dumps({field: row[field] for field in FIELDS})
+                if fmt == 'json':
+                    buffer.write(separator + record)
+                    separator = ',\n'
+                else:
+                    buffer.write(record + '\n')
+            if buffer.tell() >= flush_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if fmt == 'json':
+            buffer.write('\n]\n')
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+# Run a web-submitted import on a background worker (see UploadQueue.submit_job): the
+# spooled file is imported on a pooled connection and the outcome stored in import_jobs,
+# where the seller polls it. on_done is called after rows were imported.
+def run_import_job(app, job_id, path, fmt, user_id, on_done=None):
+    pool = app.extensions['db_pool']
+    importer = importer_for(app, user_id)
+    try:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE import_jobs SET status = 'running' WHERE id = %s", (job_id,))
+            conn.commit()
+            with open(path, 'rb') as f:
+                report = importer.run(conn, parse_rows(f, fmt))
+            cursor.execute(
+                "UPDATE import_jobs SET status = 'done', imported = %s, failed = %s, errors = %s, "
+                "finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (report['imported'], report['failed'], json.dumps(report['errors']), job_id)
+            )
+            conn.commit()
+            cursor.close()
+    except Exception:
+        app.logger.exception("Import job %s failed", job_id)
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE import_jobs SET status = 'failed', imported = %s, failed = %s, "
+                "finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (importer.imported, importer.failed, job_id)
+            )
+            conn.commit()
+            cursor.close()
+    finally:
+        os.remove(path)
+        if on_done and importer.imported:
+            on_done()
+
+
+def load_import_job(cursor, job_id, user_id):
+    cursor.execute(
+        "SELECT id, status, imported, failed, errors, created_at, finished_at FROM import_jobs "
+        "WHERE id = %s AND user_id = %s",
+        (job_id, user_id)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    job = dict(zip(('id', 'status', 'imported', 'failed', 'errors', 'created_at', 'finished_at'), row))
+    job['errors'] = json.loads(job['errors']) if job['errors'] else []
+    for key in ('created_at', 'finished_at'):
+        if job[key] is not None:
+            job[key] = str(job[key])
+    return job
+
+
+def importer_for(app, user_id, batch_size=None, fetch_images=False):
+    return Importer(
+        app.extensions['uploader'], app.extensions['blob_store'], user_id,
+        batch_size=batch_size or app.config['IMPORT_BATCH_SIZE'],
+        fetch_images=fetch_images,
+        workers=app.config['IMPORT_IMAGE_WORKERS'],
+        max_image_size=app.config['UPLOAD_MAX_FILE_SIZE'],
+        timeout=app.config['UPLOAD_TIMEOUT'],
+    )
+
+
+def init_app(app):
+    app.config.setdefault('IMPORT_BATCH_SIZE', int(os.environ.get('IMPORT_BATCH_SIZE', 500)))
+    app.config.setdefault('IMPORT_IMAGE_WORKERS', int(os.environ.get('IMPORT_IMAGE_WORKERS', 4)))
+
+    @app.cli.command('import-items')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--user-id', type=int, required=True, help='Seller the listings belong to.')
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+                  help='File format (default: from the extension).')
+    @click.option('--batch-size', type=int, default=None, help='Rows per INSERT transaction.')
+    @click.option('--fetch-images', is_flag=True, help='Download and re-host referenced images '
+                                                       '(public hosts only; not offered by the web import).')
+    def import_items_command(path, user_id, fmt, batch_size, fetch_images):
+        """Import listings from a CSV or JSONL file."""
+        importer = importer_for(app, user_id, batch_size, fetch_images)
+        with open(path, 'rb') as f:
+            report = importer.run(get_db(), parse_rows(f, detect_format(path, fmt)))
+        app.extensions['cache'].bump('listings', 'facets')
+        for error in report['errors']:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        click.echo(f"Imported {report['imported']} items, {report['failed']} rows failed")
+
+    @app.cli.command('export-items')
+    @click.argument('output', type=click.File('w'))
+    @click.option('--user-id', type=int, default=None, help='Only this seller\'s listings.')
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'json']), default='csv')
+    def export_items_command(output, user_id, fmt):
+        """Export listings as CSV, JSONL or a JSON array."""
+        for chunk in export_items(get_pool(), fmt, user_id):
+            output.write(chunk)
@@ -0,0 +1,208 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# In-process LRU cache with a per-entry TTL
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Local stand-in for a shared cache server (same interface as RedisBackend, bytes in/out)
+class LocalSharedBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl else None, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# Shared cache on Redis; the redis package is only needed when this backend is configured
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+# Two-tier cache: the in-process LRU in front of an optional shared backend.
+# Entries are invalidated by bumping namespace versions ("item:5", "listings"),
+# which every dependent key embeds; with a shared backend the versions live there
+# so a write in one worker invalidates every worker's entries. Without one, a bump only
+# reaches the worker that made it, so local versions expire after `version_ttl` seconds:
+# other workers then mint a new version and drop their entries, which bounds staleness.
+class Cache:
+    def __init__(self, local, shared=None, prefix='marketplace:', version_ttl=30):
+        self.local = local
+        self.shared = shared
+        self.prefix = prefix
+        self.version_ttl = version_ttl
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.bumps = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        raw = self.shared.get(self.prefix + key)
+        with self._lock:
+            if raw is None:
+                self.shared_misses += 1
+            else:
+                self.shared_hits += 1
+        if raw is None:
+            return None
+        value = pickle.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(self.prefix + key, pickle.dumps(value), ttl or self.local.ttl)
+
+    # Current version token of a namespace; a fresh token is minted if none exists,
+    # so an evicted version can never bring back entries written under an old one
+    def version(self, namespace):
+        key = 'v:' + namespace
+        if self.shared is not None:
+            token = self.shared.get(self.prefix + key)
+            if token is None:
+                token = uuid.uuid4().hex[:12].encode()
+                self.shared.set(self.prefix + key, token)
+            return token.decode()
+        token = self.local.get(key)
+        if token is None:
+            token = uuid.uuid4().hex[:12]
+            self.local.set(key, token, ttl=self.version_ttl)
+        return token
+
+    def bump(self, *namespaces):
+        for namespace in namespaces:
+            key = 'v:' + namespace
+            token = uuid.uuid4().hex[:12]
+            if self.shared is not None:
+                self.shared.set(self.prefix + key, token.encode())
+            else:
+                self.local.set(key, token, ttl=self.version_ttl)
+        with self._lock:
+            self.bumps += len(namespaces)
+
+    # Fetch key, or compute, store and return it
+    def get_or_set(self, key, compute, ttl=None):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def stats(self):
+        stats = {'local': self.local.stats(), 'bumps': self.bumps}
+        if self.shared is not None:
+            stats['shared'] = {'hits': self.shared_hits, 'misses': self.shared_misses}
+        return stats
+
+
+def init_app(app):
+    app.config.setdefault('CACHE_SIZE', int(os.environ.get('CACHE_SIZE', 2048)))
+    app.config.setdefault('CACHE_TTL', int(os.environ.get('CACHE_TTL', 300)))
+    app.config.setdefault('CACHE_SHARED_BACKEND', os.environ.get('CACHE_SHARED_BACKEND', ''))
+    app.config.setdefault('CACHE_REDIS_URL', os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    # Without a shared backend: seconds another worker may keep serving an entry after a write
+    app.config.setdefault('CACHE_VERSION_TTL', int(os.environ.get('CACHE_VERSION_TTL', 30)))
+
+    shared = None
+    if app.config['CACHE_SHARED_BACKEND'] == 'local':
+        shared = LocalSharedBackend()
+    elif app.config['CACHE_SHARED_BACKEND'] == 'redis':
+        shared = RedisBackend(app.config['CACHE_REDIS_URL'])
+
+    app.extensions['cache'] = Cache(LRUCache(app.config['CACHE_SIZE'], app.config['CACHE_TTL']), shared,
+                                    version_ttl=app.config['CACHE_VERSION_TTL'])
+
+
+def get_cache():
+    return current_app.extensions['cache']
@@ -0,0 +1,351 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+from flask import current_app, g, request
+
+
+class PoolExhausted(Error):
+    pass
+
+
+# Connection pool shared by every route and helper in the app
+class ConnectionPool:
+    def __init__(self, connect_args, size=10, timeout=5.0, recycle=3600, ping_interval=30):
+        self.connect_args = connect_args
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle  # Max age (seconds) before a connection is replaced
+        self.ping_interval = ping_interval  # Idle time (seconds) before a health check
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, last_used), most recently used on the right
+        self._created_at = {}
+        self._open = 0
+        self._stats = {
+            'checkouts': 0,
+            'checkins': 0,
+            'created': 0,
+            'recycled': 0,
+            'failed_health_checks': 0,
+            'exhausted': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.connect_args)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats['created'] += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _is_healthy(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if self.ping_interval is not None and now - last_used > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Error:
+                with self._cond:
+                    self._stats['failed_health_checks'] += 1
+                return False
+        return True
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    entry = None
+                    break
+                if not waited:
+                    self._stats['exhausted'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhausted(msg=f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+
+        # Connecting and pinging happen outside the lock; the slot is already reserved
+        try:
+            if entry is not None:
+                conn, created_at, last_used = entry
+                if not self._is_healthy(conn, created_at, last_used):
+                    self._close(conn)
+                    conn = self._connect()
+            else:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        wait = time.monotonic() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += wait
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait)
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # End any open transaction so the next borrower gets a fresh snapshot
+                conn.rollback()
+            except Error:
+                discard = True
+        with self._cond:
+            self._stats['checkins'] += 1
+            created_at = self._created_at.get(id(conn))
+            if discard or created_at is None:
+                self._open -= 1
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+        if discard or created_at is None:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            discard = not conn.is_connected()
+            raise
+        finally:
+            # Also runs on GeneratorExit, when a streaming response is closed early
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+
+# Cursor that records every statement it runs in the request's query stats
+class TrackedCursor:
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def _run(self, method, operation, params):
+        start = time.perf_counter()
+        try:
+            return method(operation, params) if params is not None else method(operation)
+        finally:
+            self._stats.record(operation, params, time.perf_counter() - start)
+
+    def execute(self, operation, params=None):
+        return self._run(self._cursor.execute, operation, params)
+
+    def executemany(self, operation, seq_params):
+        return self._run(self._cursor.executemany, operation, seq_params)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# The request's pooled connection; cursors it hands out are tracked
+class TrackedConnection:
+    def __init__(self, conn, stats):
+        self._conn = conn
+        self._stats = stats
+
+    def cursor(self, *args, **kwargs):
+        return TrackedCursor(self._conn.cursor(*args, **kwargs), self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# Per-request query count and time, plus statements repeated with identical parameters.
+# The first MAX_STATEMENTS statements are kept (with timings) for the slow-request log.
+class QueryStats:
+    MAX_STATEMENTS = 100
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.duplicates = 0
+        self.statements = []
+        self._seen = set()
+
+    def record(self, operation, params, elapsed):
+        self.count += 1
+        self.time += elapsed
+        if len(self.statements) < self.MAX_STATEMENTS:
+            self.statements.append((operation, elapsed))
+        try:
+            key = (operation, repr(params))
+        except Exception:
+            return
+        if key in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(key)
+
+    def as_dict(self):
+        return {'count': self.count, 'time': self.time, 'duplicates': self.duplicates}
+
+
+def init_app(app):
+    app.config.setdefault('DB_HOST', os.environ.get('DB_HOST', 'localhost'))
+    app.config.setdefault('DB_USER', os.environ.get('DB_USER', 'root'))
+    app.config.setdefault('DB_PASSWORD', os.environ.get('DB_PASSWORD', ''))
+    app.config.setdefault('DB_NAME', os.environ.get('DB_NAME', 'marketplace'))
+    app.config.setdefault('DB_POOL_SIZE', int(os.environ.get('DB_POOL_SIZE', 10)))
+    app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 5)))
+    app.config.setdefault('DB_POOL_RECYCLE', int(os.environ.get('DB_POOL_RECYCLE', 3600)))
+    app.config.setdefault('DB_POOL_PING_INTERVAL', int(os.environ.get('DB_POOL_PING_INTERVAL', 30)))
+    # The C extension blocks the whole process under gevent (ASYNC_MODE=gevent, see gunicorn.conf.py);
+    # the pure-Python protocol goes through patched sockets and yields while waiting on MySQL
+    use_pure = os.environ.get('DB_USE_PURE', '1' if os.environ.get('ASYNC_MODE') == 'gevent' else '0')
+    app.config.setdefault('DB_USE_PURE', use_pure == '1')
+
+    app.extensions['db_pool'] = ConnectionPool(
+        {
+            'host': app.config['DB_HOST'],
+            'user': app.config['DB_USER'],
+            'password': app.config['DB_PASSWORD'],
+            'database': app.config['DB_NAME'],
+            'use_pure': app.config['DB_USE_PURE'],
+        },
+        size=app.config['DB_POOL_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        recycle=app.config['DB_POOL_RECYCLE'],
+        ping_interval=app.config['DB_POOL_PING_INTERVAL'],
+    )
+    # Log requests that run more than this many queries (0 disables); the count and
+    # time are also sent as X-Query-Count / X-Query-Time when headers are enabled or testing
+    app.config.setdefault('DB_QUERY_WARN_THRESHOLD', int(os.environ.get('DB_QUERY_WARN_THRESHOLD', 20)))
+    app.config.setdefault('DB_QUERY_HEADERS', os.environ.get('DB_QUERY_HEADERS', '') == '1')
+    # Rows fetched per round trip by unbuffered cursors (iter_rows / stream_query)
+    app.config.setdefault('DB_STREAM_FETCH_SIZE', int(os.environ.get('DB_STREAM_FETCH_SIZE', 200)))
+
+    app.after_request(report_queries)
+    app.teardown_appcontext(release_db)
+
+
+def get_pool():
+    return current_app.extensions['db_pool']
+
+
+# Iterate a query's rows through an unbuffered (server-side) cursor, `size` rows per fetch,
+# so a large result is never held in memory at once. The connection can't run another
+# query until the iteration ends; stopping early discards the rest of the result.
+def iter_rows(conn, sql, params=(), size=500, dictionary=False):
+    cursor = conn.cursor(dictionary=dictionary, buffered=False)
+    finished = False
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield from rows
+        finished = True
+    finally:
+        if not finished:
+            conn.consume_results()
+        cursor.close()
+
+
+# Rows of a query, read through iter_rows() on a connection of their own so a response can
+# render or serialize them as they arrive while the request's connection stays free. The
+# connection is checked out on the first row and returned when the rows run out or the
+# generator is closed; its queries still count toward the request's stats. Call release_db()
+# before reading the first row in a request, so the request never holds two connections.
+def stream_query(sql, params=(), size=None, dictionary=True):
+    pool = get_pool()
+    stats = query_stats()
+    size = size or current_app.config['DB_STREAM_FETCH_SIZE']
+
+    def rows():
+        with pool.connection() as conn:
+            yield from iter_rows(TrackedConnection(conn, stats), sql, params, size, dictionary)
+    return rows()
+
+
+# Queries run so far in the current app context
+def query_stats():
+    if 'query_stats' not in g:
+        g.query_stats = QueryStats()
+    return g.query_stats
+
+
+# Check out one connection per app context; it is returned to the pool on teardown.
+# Every helper called during a request shares it, and its queries are counted.
+def get_db():
+    if 'db_conn' not in g:
+        g.db_conn = get_pool().acquire()
+        g.db_tracked = TrackedConnection(g.db_conn, query_stats())
+    return g.db_tracked
+
+
+def report_queries(response):
+    stats = query_stats()
+    config = current_app.config
+    if config['DB_QUERY_HEADERS'] or current_app.testing:
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers['X-Query-Time'] = f"{stats.time * 1000:.1f}ms"
+    threshold = config['DB_QUERY_WARN_THRESHOLD']
+    if threshold and stats.count > threshold:
+        current_app.logger.warning("%s %s ran %d queries (%d duplicates, %.1fms)", request.method, request.path,
+                                   stats.count, stats.duplicates, stats.time * 1000)
+    return response
+
+
+def release_db(exc=None):
+    g.pop('db_tracked', None)
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().release(conn, discard=exc is not None and not conn.is_connected())
@@ -0,0 +1,116 @@
+from decimal import Decimal, InvalidOperation
+
+import click
+
+from cache import get_cache
+from db import get_db
+
+# Lower bounds of the price buckets shown in filter menus; the last bucket is open-ended
+PRICE_BUCKETS = (0, 100, 500, 1000, 5000, 10000)
+
+
+def price_bucket(price):
+    try:
+        price = Decimal(str(price))
+    except InvalidOperation:
+        return 0
+    bucket = 0
+    for index, lower in enumerate(PRICE_BUCKETS):
+        if price >= lower:
+            bucket = index
+    return bucket
+
+
+def bucket_label(bucket):
+    lower = PRICE_BUCKETS[bucket]
+    if bucket + 1 < len(PRICE_BUCKETS):
+        return f"{lower}-{PRICE_BUCKETS[bucket + 1]}"
+    return f"{lower}+"
+
+
+# The same bucketing as price_bucket(), as SQL for rebuilding the summary from items
+def price_bucket_sql(column='price'):
+    cases = ' '.join(
+        f"WHEN {column} < {PRICE_BUCKETS[index + 1]} THEN {index}" for index in range(len(PRICE_BUCKETS) - 1)
+    )
+    return f"CASE {cases} ELSE {len(PRICE_BUCKETS) - 1} END"
+
+
+# Apply item count changes to the item_facets summary in the caller's transaction.
+# changes are (category, quality, price, delta); bump the 'facets' cache version after commit.
+def adjust_facets(cursor, changes):
+    totals = {}
+    for category, quality, price, delta in changes:
+        key = (category, quality, price_bucket(price))
+        totals[key] = totals.get(key, 0) + delta
+    rows = [key + (delta,) for key, delta in totals.items() if delta]
+    if rows:
+        cursor.executemany(
+            "INSERT INTO item_facets (category, quality, price_bucket, item_count) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE item_count = item_count + VALUES(item_count)",
+            rows
+        )
+
+
+# Recount the whole summary from items (backfill, or repair after out-of-band edits)
+def rebuild_facets(cursor):
+    cursor.execute("DELETE FROM item_facets")
+    cursor.execute(
+        "INSERT INTO item_facets (category, quality, price_bucket, item_count) "
+        f"SELECT category, quality, {price_bucket_sql()} AS bucket, COUNT(*) FROM items "
+        "GROUP BY category, quality, bucket"
+    )
+
+
+# In-memory copy of item_facets; a few hundred rows at most, whatever the catalog size
+class FacetSummary:
+    def __init__(self, rows):
+        self.rows = [(category, quality, bucket, count) for category, quality, bucket, count in rows if count > 0]
+
+    # Counts per category, quality and price bucket. Each facet is counted under the
+    # other facets' filters but not its own, so every option shows what picking it would give.
+    def counts(self, category=None, quality=None, bucket=None):
+        facets = {'category': {}, 'quality': {}, 'price': {}, 'total': 0}
+        for row_category, row_quality, row_bucket, count in self.rows:
+            match_category = category in (None, 'all') or row_category == category
+            match_quality = quality in (None, 'all') or row_quality == quality
+            match_bucket = bucket is None or row_bucket == bucket
+            if match_quality and match_bucket:
+                facets['category'][row_category] = facets['category'].get(row_category, 0) + count
+            if match_category and match_bucket:
+                facets['quality'][row_quality] = facets['quality'].get(row_quality, 0) + count
+            if match_category and match_quality:
+                label = bucket_label(row_bucket)
+                facets['price'][label] = facets['price'].get(label, 0) + count
+            if match_category and match_quality and match_bucket:
+                facets['total'] += count
+        return facets
+
+
+def load_facets():
+    cursor = get_db().cursor()
+    cursor.execute("SELECT category, quality, price_bucket, item_count FROM item_facets")
+    rows = cursor.fetchall()
+    cursor.close()
+    return FacetSummary(rows)
+
+
+# The summary is cached under the 'facets' version, so requests don't touch the database.
+# It keeps the normal TTL: without a shared backend a bump only reaches the worker that
+# made the write, and the others pick up new counts when their copy expires.
+def get_facets():
+    cache = get_cache()
+    return cache.get_or_set(f"facets:{cache.version('facets')}", load_facets)
+
+
+def init_app(app):
+    @app.cli.command('rebuild-facets')
+    def rebuild_facets_command():
+        """Recount the category/quality/price facet summary from the items table."""
+        conn = get_db()
+        cursor = conn.cursor()
+        rebuild_facets(cursor)
+        conn.commit()
+        cursor.close()
+        get_cache().bump('facets')
+        click.echo("Facet counts rebuilt")
@@ -0,0 +1,39 @@
+import os
+
+# Run with `gunicorn -c gunicorn.conf.py` after `flask migrate` and `flask build-assets`; the
+# app comes from the factory, and each worker warms up (pool, templates, caches) before it
+# accepts requests.
+#
+# ASYNC_MODE=gevent switches to cooperative workers: gevent patches sockets, threads and
+# queues before the app is imported, so every MySQL round trip, Cloudinary upload and
+# open /status_events stream yields to other requests instead of blocking the worker.
+# One worker then keeps up to WORKER_CONNECTIONS requests in flight. Needs the gevent
+# package; db.py switches mysql-connector to its pure-Python protocol in this mode
+# because the C extension's socket calls can't be patched. Otherwise workers are threaded.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', '')
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+if ASYNC_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 500))
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+
+def post_worker_init(worker):
+    from startup import warm_up
+    warm_up(worker.wsgi)
+
+
+# Cache invalidations reach other workers only through a shared backend; without one they
+# keep serving entries for up to CACHE_VERSION_TTL seconds after a write (see cache.py)
+def when_ready(server):
+    if workers > 1 and os.environ.get('CACHE_SHARED_BACKEND') != 'redis':
+        server.log.warning("%d workers without CACHE_SHARED_BACKEND=redis: cached pages may stay stale "
+                           "for up to CACHE_VERSION_TTL (%s s) after a write", workers,
+                           os.environ.get('CACHE_VERSION_TTL', 30))
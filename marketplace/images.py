@@ -0,0 +1,125 @@
+import io
+import json
+import os
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+
+# Widths generated for grid cards; browsers pick one from the srcset
+VARIANT_WIDTHS = (320, 640, 1024)
+
+# Modern formats first so <picture> prefers them
+VARIANT_FORMATS = [('AVIF', 'image/avif', 'avif', 50), ('WEBP', 'image/webp', 'webp', 80)]
+
+
+# Pillow is imported on first use rather than at startup; AVIF is only generated if this
+# Pillow build can write it
+@lru_cache(maxsize=None)
+def writable_formats():
+    from PIL import features
+    return [f for f in VARIANT_FORMATS if f[0] != 'AVIF' or features.check('avif')]
+
+# Grid columns are 2 / 3 / 4 per row (see the Bootstrap row-cols-* classes)
+GRID_SIZES = "(min-width: 992px) 25vw, (min-width: 768px) 33vw, 50vw"
+
+# The item page's slideshow takes about half the width beside the details, all of it on phones
+DETAIL_SIZES = "(min-width: 992px) 50vw, 100vw"
+
+
+def open_image(src):
+    from PIL import Image, ImageOps
+    if hasattr(src, 'stream'):
+        src.stream.seek(0)
+        src = src.stream
+    image = Image.open(src)
+    # Apply the EXIF orientation to the pixels; the EXIF block itself is not carried over
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+# Displayed (width, height) read from the header only, or (None, None) if unreadable
+def image_size(src):
+    from PIL import Image
+    try:
+        stream = src.stream if hasattr(src, 'stream') else src
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        with Image.open(stream) as image:
+            width, height = image.size
+            # EXIF orientations 5-8 are rotated a quarter turn
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        return width, height
+    except (OSError, Image.DecompressionBombError):
+        return None, None
+
+
+# Resize one source image into every width/format; returns [(mime, width, FileStorage)].
+# CPU-heavy (AVIF especially), so web requests leave it to the upload queue. Pass `logger`
+# when calling outside an app context.
+def make_derivatives(src, name, logger=None):
+    from PIL import Image
+    try:
+        image = open_image(src)
+    except (OSError, Image.DecompressionBombError) as e:
+        (logger or current_app.logger).warning("Error reading image %s: %s", name, e)
+        return []
+
+    stem = os.path.splitext(os.path.basename(name))[0] or 'image'
+    derivatives = []
+    widths = [w for w in VARIANT_WIDTHS if w < image.width] or [image.width]
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for pil_format, mime, extension, quality in writable_formats():
+            buffer = io.BytesIO()
+            # Saving without exif=/icc_profile= strips the source metadata
+            resized.save(buffer, pil_format, quality=quality)
+            buffer.seek(0)
+            file = FileStorage(stream=buffer, filename=f"{stem}_{width}.{extension}", content_type=mime)
+            derivatives.append((mime, width, file))
+    return derivatives
+
+
+# Pair derivatives with their uploaded URLs: {mime: {width: url}}
+def collect_variants(derivatives, urls):
+    variants = {}
+    for (mime, width, _), url in zip(derivatives, urls):
+        if url:
+            variants.setdefault(mime, {})[str(width)] = url
+    return variants
+
+
+def variant_urls(variants):
+    return [url for widths in variants.values() for url in widths.values()]
+
+
+# <source> entries for a <picture>, built from the item's stored grid_variants JSON
+def image_sources(item):
+    return variant_sources(item.get('grid_variants') if isinstance(item, dict) else None, GRID_SIZES)
+
+
+# The same for one of the item page's detail images (an item_images row)
+def detail_image_sources(image):
+    return variant_sources(image.get('variants') if isinstance(image, dict) else None, DETAIL_SIZES)
+
+
+def variant_sources(raw, sizes):
+    if not raw:
+        return []
+    try:
+        variants = json.loads(raw) if isinstance(raw, str) else raw
+    except ValueError:
+        return []
+    sources = []
+    for _, mime, _, _ in VARIANT_FORMATS:
+        widths = variants.get(mime)
+        if widths:
+            srcset = ', '.join(f"{url} {width}w" for width, url in sorted(widths.items(), key=lambda w: int(w[0])))
+            sources.append({'type': mime, 'srcset': srcset, 'sizes': sizes})
+    return sources
@@ -0,0 +1,35 @@
+import json
+
+
+# Store an item's detail images in display order; images are (url, width, height[, variants])
+def save_item_images(cursor, item_id, images):
+    rows = []
+    for position, image in enumerate(images):
+        url, width, height = image[:3]
+        variants = image[3] if len(image) > 3 else None
+        rows.append((item_id, position, url, width, height, json.dumps(variants) if variants else None))
+    if rows:
+        cursor.executemany(
+            "INSERT INTO item_images (item_id, position, url, width, height, variants) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows
+        )
+
+
+# Fetch the images of many items in one query: {item_id: [image, ...]} in display order
+def load_item_images(cursor, item_ids):
+    item_ids = list(dict.fromkeys(item_ids))
+    images = {item_id: [] for item_id in item_ids}
+    if not item_ids:
+        return images
+    cursor.execute(
+        "SELECT item_id, position, url, width, height, variants FROM item_images "
+        f"WHERE item_id IN ({', '.join(['%s'] * len(item_ids))}) ORDER BY item_id, position",
+        tuple(item_ids)
+    )
+    for row in cursor.fetchall():
+        if not isinstance(row, dict):
+            row = dict(zip(('item_id', 'position', 'url', 'width', 'height', 'variants'), row))
+        row['variants'] = json.loads(row['variants']) if row['variants'] else None
+        images[row['item_id']].append(row)
+    return images
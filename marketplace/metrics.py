@@ -0,0 +1,242 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, current_app, g, has_request_context, request, template_rendered
+
+import db
+
+# Latency buckets in seconds, plus buckets for query counts and response sizes in bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+# Time spent per request outside the handler's own code, reported separately
+PHASES = ('db', 'render', 'upload', 'images')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    # Prometheus exposition lines; bucket counts are cumulative
+    def lines(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+# Process-wide request metrics, keyed by endpoint
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.latency = {}  # endpoint -> Histogram
+        self.queries = {}
+        self.sizes = {}
+        self.phases = {}  # (endpoint, phase) -> seconds
+        self.counters = {}  # (name, labels) -> count
+
+    def observe(self, endpoint, method, status, duration, queries, size, phases):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.queries.setdefault(endpoint, Histogram(QUERY_BUCKETS)).observe(queries)
+            if size is not None:
+                self.sizes.setdefault(endpoint, Histogram(SIZE_BUCKETS)).observe(size)
+            for phase, seconds in phases.items():
+                self.phases[(endpoint, phase)] = self.phases.get((endpoint, phase), 0.0) + seconds
+
+    def increment(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def add_phase(self, endpoint, phase, seconds):
+        with self._lock:
+            self.phases[(endpoint, phase)] = self.phases.get((endpoint, phase), 0.0) + seconds
+
+    # gauges and totals are (name, value) pairs read at scrape time, e.g. from the pool
+    def render(self, gauges=(), totals=()):
+        with self._lock:
+            lines = [
+                '# HELP marketplace_requests_total Requests served.',
+                '# TYPE marketplace_requests_total counter',
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'marketplace_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                )
+            for name, help_text, histograms in (
+                ('marketplace_request_duration_seconds', 'Request latency.', self.latency),
+                ('marketplace_request_queries', 'Database queries per request.', self.queries),
+                ('marketplace_response_size_bytes', 'Response body size.', self.sizes),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.lines(name, f'endpoint="{endpoint}"'))
+            lines.append('# HELP marketplace_request_phase_seconds_total Time spent in DB, templates and uploads.')
+            lines.append('# TYPE marketplace_request_phase_seconds_total counter')
+            for (endpoint, phase), seconds in sorted(self.phases.items()):
+                lines.append(
+                    f'marketplace_request_phase_seconds_total{{endpoint="{endpoint}",phase="{phase}"}} {seconds}'
+                )
+            typed = set()
+            for (name, labels), count in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                lines.append(f'{name}{{{label_text}}} {count}')
+        for name, value in totals:
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {value}')
+        for name, value in gauges:
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Count an event (e.g. a rate-limited login) under a labelled counter on /metrics
+def count(name, **labels):
+    current_app.extensions['metrics'].increment(name, **labels)
+
+
+# Add the time spent in the block to a phase of the current request
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'metrics_phases' in g:
+            g.metrics_phases[phase] = g.metrics_phases.get(phase, 0.0) + time.perf_counter() - start
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_phases = {}
+    g.metrics_render_depth = 0
+
+
+# Templates nest (item_card renders inside main_index), so only the outermost render is timed
+def template_started(sender, template, context, **extra):
+    if not has_request_context() or 'metrics_phases' not in g:
+        return
+    if g.metrics_render_depth == 0:
+        g.metrics_render_start = time.perf_counter()
+    g.metrics_render_depth += 1
+
+
+def template_finished(sender, template, context, **extra):
+    if not has_request_context() or not g.get('metrics_render_depth'):
+        return
+    g.metrics_render_depth -= 1
+    if g.metrics_render_depth == 0:
+        elapsed = time.perf_counter() - g.metrics_render_start
+        g.metrics_phases['render'] = g.metrics_phases.get('render', 0.0) + elapsed
+
+
+# A streamed page renders after finish_request has run, so the stream times itself and adds
+# what it spent to the endpoint's render phase once it is exhausted (or the client goes away)
+def timed_stream(pieces):
+    store = current_app.extensions['metrics']
+    endpoint = request.endpoint or 'unmatched'
+
+    def timed_pieces():
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    piece = next(pieces)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield piece
+        finally:
+            store.add_phase(endpoint, 'render', elapsed)
+    return timed_pieces()
+
+
+def finish_request(response):
+    if 'metrics_start' not in g:
+        return response
+    duration = time.perf_counter() - g.metrics_start
+    stats = db.query_stats()
+    phases = dict(g.metrics_phases)
+    if stats.count:
+        phases['db'] = stats.time
+    endpoint = request.endpoint or 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+
+    current_app.extensions['metrics'].observe(
+        endpoint, request.method, response.status_code, duration, stats.count, size, phases
+    )
+
+    config = current_app.config
+    threshold = config['METRICS_SLOW_REQUEST_MS']
+    if threshold and duration * 1000 >= threshold and random.random() < config['METRICS_SLOW_SAMPLE_RATE']:
+        log_slow_request(endpoint, duration, phases, stats)
+    return response
+
+
+def log_slow_request(endpoint, duration, phases, stats):
+    breakdown = ', '.join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in sorted(phases.items()))
+    lines = [
+        f"Slow request: {request.method} {request.full_path.rstrip('?')} ({endpoint}) "
+        f"{duration * 1000:.1f}ms, {stats.count} queries [{breakdown}]"
+    ]
+    for operation, elapsed in stats.statements:
+        lines.append(f"  {elapsed * 1000:8.1f}ms  {' '.join(operation.split())}")
+    current_app.logger.warning('\n'.join(lines))
+
+
+def metrics_view():
+    pool = db.get_pool().stats()
+    gauges = [
+        ('marketplace_db_pool_in_use', pool['in_use']),
+        ('marketplace_db_pool_idle', pool['idle']),
+        ('marketplace_db_pool_wait_seconds_max', pool['wait_time_max']),
+    ]
+    totals = [('marketplace_db_pool_timeouts_total', pool['timeouts'])]
+    # Other modules add gauges by registering a callable in app.extensions['metrics_gauges']
+    for provider in current_app.extensions.get('metrics_gauges', ()):
+        gauges.extend(provider())
+    return Response(current_app.extensions['metrics'].render(gauges, totals), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    # Requests at least this slow (0 disables) are logged with their SQL, for a sampled fraction
+    app.config.setdefault('METRICS_SLOW_REQUEST_MS', int(os.environ.get('METRICS_SLOW_REQUEST_MS', 500)))
+    app.config.setdefault('METRICS_SLOW_SAMPLE_RATE', float(os.environ.get('METRICS_SLOW_SAMPLE_RATE', 1.0)))
+
+    app.extensions['metrics'] = Metrics()
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
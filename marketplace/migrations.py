@@ -0,0 +1,353 @@
+import click
+from mysql.connector import Error
+
+from db import get_db
+
+# Named lock so several workers starting at once don't run the same migration twice
+LOCK_NAME = 'marketplace_schema_migrations'
+LOCK_TIMEOUT = 60
+
+
+def table_exists(cursor, table):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table,))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+
+def add_column(cursor, table, column, definition):
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(cursor, table, index, columns, kind='INDEX'):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} {index} ({columns})")
+
+
+# Migration 1: the tables the app has always expected (no-op on existing databases)
+def create_base_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            username VARCHAR(100) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            password VARCHAR(255) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            description TEXT NOT NULL,
+            quality ENUM('new', 'used_like_new', 'used_good', 'used_fair') NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            meetup_place VARCHAR(255) NOT NULL,
+            seller_phone VARCHAR(15) NOT NULL,
+            grid_image VARCHAR(255),
+            detail_images TEXT,
+            user_id INT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS saved_items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            item_id INT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS handle_request (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sender_name VARCHAR(255),
+            sender_number VARCHAR(50),
+            reference_type VARCHAR(100) NOT NULL,
+            screenshot VARCHAR(255),
+            status VARCHAR(20) NOT NULL DEFAULT 'Pending',
+            item_name VARCHAR(255)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS status_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            reference_type VARCHAR(100) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Migration 2: replaces the old update_users_table() startup ALTER
+def add_users_profile_picture(cursor):
+    add_column(cursor, 'users', 'profile_picture', "VARCHAR(255)")
+
+
+# Migration 3: FULLTEXT indexes used by /search
+def add_search_indexes(cursor):
+    add_index(cursor, 'items', 'ft_items_name', "name", kind='FULLTEXT INDEX')
+    add_index(cursor, 'items', 'ft_items_name_description', "name, description", kind='FULLTEXT INDEX')
+
+
+# Migration 4: secondary indexes for the filters and lookups the routes run on every request
+def add_query_indexes(cursor):
+    add_index(cursor, 'items', 'idx_items_category_price', "category, price, id")
+    add_index(cursor, 'items', 'idx_items_price', "price, id")
+    add_index(cursor, 'items', 'idx_items_quality_price', "quality, price")
+    add_index(cursor, 'users', 'idx_users_email', "email")
+    add_index(cursor, 'users', 'idx_users_username', "username")
+    add_index(cursor, 'handle_request', 'idx_handle_request_reference_type', "reference_type")
+    add_index(cursor, 'status_history', 'idx_status_history_reference_type', "reference_type")
+
+    # Drop duplicate saves left by the old SELECT-then-INSERT race before adding the unique key
+    if not index_exists(cursor, 'saved_items', 'uq_saved_items_user_item'):
+        if column_exists(cursor, 'saved_items', 'id'):
+            cursor.execute("""
+                DELETE s1 FROM saved_items s1
+                JOIN saved_items s2
+                  ON s1.user_id = s2.user_id AND s1.item_id = s2.item_id AND s1.id > s2.id
+            """)
+            add_index(cursor, 'saved_items', 'uq_saved_items_user_item', "user_id, item_id", kind='UNIQUE INDEX')
+        else:
+            # No surrogate key to pick a survivor by: rebuild the table through INSERT IGNORE
+            cursor.execute("DROP TABLE IF EXISTS saved_items_dedup")
+            cursor.execute("CREATE TABLE saved_items_dedup LIKE saved_items")
+            cursor.execute("ALTER TABLE saved_items_dedup ADD UNIQUE INDEX uq_saved_items_user_item (user_id, item_id)")
+            cursor.execute("INSERT IGNORE INTO saved_items_dedup SELECT * FROM saved_items")
+            cursor.execute("RENAME TABLE saved_items TO saved_items_old, saved_items_dedup TO saved_items")
+            cursor.execute("DROP TABLE saved_items_old")
+    add_index(cursor, 'saved_items', 'idx_saved_items_item', "item_id")
+
+
+# Migration 5: resized WebP/AVIF copies of the grid image, as {mime: {width: url}} JSON
+def add_items_grid_variants(cursor):
+    add_column(cursor, 'items', 'grid_variants', "TEXT")
+
+
+# Migration 6: which items/proofs use which content-addressed uploads (see storage.py)
+def create_blob_refs(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blob_refs (
+            path VARCHAR(255) NOT NULL,
+            owner_type VARCHAR(20) NOT NULL,
+            owner_id INT NOT NULL,
+            PRIMARY KEY (owner_type, owner_id, path),
+            INDEX idx_blob_refs_path (path)
+        )
+    """)
+
+
+# Migration 7: one row per detail image, backfilled from the comma-joined items.detail_images
+def create_item_images(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS item_images (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            item_id INT NOT NULL,
+            position SMALLINT NOT NULL,
+            url VARCHAR(255) NOT NULL,
+            width INT,
+            height INT,
+            variants TEXT,
+            UNIQUE INDEX uq_item_images_item_position (item_id, position),
+            FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+        )
+    """)
+
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, detail_images FROM items
+            WHERE id > %s AND detail_images IS NOT NULL AND detail_images != ''
+            ORDER BY id LIMIT 1000
+        """, (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        images = [
+            (item_id, position, url.strip())
+            for item_id, detail_images in rows
+            for position, url in enumerate(u for u in detail_images.split(',') if u.strip())
+        ]
+        if images:
+            cursor.executemany(
+                "INSERT IGNORE INTO item_images (item_id, position, url) VALUES (%s, %s, %s)",
+                images
+            )
+        last_id = rows[-1][0]
+
+
+# Migration 8: the admin review queue pages through proofs by status (see admin_queue.py)
+def add_handle_request_status_index(cursor):
+    add_index(cursor, 'handle_request', 'idx_handle_request_status', "status, id")
+
+
+# Migration 9: item counts per category x quality x price bucket for the filter menus (see facets.py)
+def create_item_facets(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS item_facets (
+            category VARCHAR(100) NOT NULL,
+            quality VARCHAR(20) NOT NULL,
+            price_bucket TINYINT NOT NULL,
+            item_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, quality, price_bucket)
+        )
+    """)
+    # Backfill with the price buckets as they were when this migration was written; later
+    # bucket changes rebuild the summary with `flask rebuild-facets`, not by editing this
+    cursor.execute("DELETE FROM item_facets")
+    cursor.execute("""
+        INSERT INTO item_facets (category, quality, price_bucket, item_count)
+        SELECT category, quality,
+               CASE WHEN price < 100 THEN 0 WHEN price < 500 THEN 1 WHEN price < 1000 THEN 2
+                    WHEN price < 5000 THEN 3 WHEN price < 10000 THEN 4 ELSE 5 END AS bucket,
+               COUNT(*)
+        FROM items
+        GROUP BY category, quality, bucket
+    """)
+
+
+# Migration 10: precomputed neighbours per item for item_detail (filled by `flask build-similar`)
+def create_item_similar(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS item_similar (
+            item_id INT NOT NULL,
+            position TINYINT NOT NULL,
+            similar_id INT NOT NULL,
+            score FLOAT NOT NULL,
+            PRIMARY KEY (item_id, position),
+            FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
+            FOREIGN KEY (similar_id) REFERENCES items(id) ON DELETE CASCADE
+        )
+    """)
+
+
+# Migration 11: web-submitted imports run in the background; sellers poll their outcome here
+def create_import_jobs(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            imported INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            errors MEDIUMTEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+
+
+# Ordered list of (version, name, function); never edit an entry once it has shipped
+MIGRATIONS = [
+    (1, 'create_base_tables', create_base_tables),
+    (2, 'add_users_profile_picture', add_users_profile_picture),
+    (3, 'add_search_indexes', add_search_indexes),
+    (4, 'add_query_indexes', add_query_indexes),
+    (5, 'add_items_grid_variants', add_items_grid_variants),
+    (6, 'create_blob_refs', create_blob_refs),
+    (7, 'create_item_images', create_item_images),
+    (8, 'add_handle_request_status_index', add_handle_request_status_index),
+    (9, 'create_item_facets', create_item_facets),
+    (10, 'create_item_similar', create_item_similar),
+    (11, 'create_import_jobs', create_import_jobs),
+]
+
+
+def create_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Versions already applied; read-only (none before the first `flask migrate`)
+def applied_versions(cursor):
+    try:
+        cursor.execute("SELECT version FROM schema_migrations")
+    except Error:
+        return set()
+    return {row[0] for row in cursor.fetchall()}
+
+
+# Names of the migrations not applied yet; read-only, so safe to call at startup
+def pending_migrations(cursor):
+    done = applied_versions(cursor)
+    return [name for version, name, _ in MIGRATIONS if version not in done]
+
+
+# Apply every pending migration in order; returns the names that ran
+def migrate(conn, target=None):
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        raise RuntimeError("Timed out waiting for the schema migration lock")
+
+    ran = []
+    try:
+        create_migrations_table(cursor)
+        done = applied_versions(cursor)
+        for version, name, apply in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            # MySQL DDL commits implicitly, so each step is written to be safe to re-run
+            apply(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+            conn.commit()
+            ran.append(name)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+    return ran
+
+
+def init_app(app):
+    @app.cli.command('migrate')
+    @click.option('--target', type=int, default=None, help='Stop after this version.')
+    def migrate_command(target):
+        """Apply pending schema migrations."""
+        ran = migrate(get_db(), target)
+        if ran:
+            for name in ran:
+                click.echo(f"Applied {name}")
+        else:
+            click.echo("Schema is up to date.")
+
+    @app.cli.command('migrations')
+    def migrations_command():
+        """List migrations and whether they have been applied."""
+        cursor = get_db().cursor()
+        done = applied_versions(cursor)
+        cursor.close()
+        for version, name, _ in MIGRATIONS:
+            mark = 'x' if version in done else ' '
+            click.echo(f"[{mark}] {version:04d} {name}")
@@ -0,0 +1,230 @@
+import ast
+import os
+import re
+
+import click
+
+from db import get_db
+
+# Source files whose SQL is audited
+AUDITED_FILES = [
+    'app.py', 'search.py', 'storage.py', 'item_images.py', 'admin_queue.py', 'saved.py', 'similar.py',
+    'facets.py', 'bulk_items.py', 'uploads.py',
+]
+
+# Calls that run SQL, and the position of the statement among their arguments
+SQL_CALLS = {'execute': 0, 'stream_query': 0, 'iter_rows': 1}
+
+# Statements that scan on purpose (tiny lookup tables, whole-catalog rebuilds and dumps);
+# keyed by "file:function" of the call that runs them
+ALLOWED_FULL_SCANS = {
+    'facets.py:rebuild_facets',
+    'facets.py:load_facets',
+    'similar.py:rebuild_similar',
+    'bulk_items.py:export_items',
+}
+
+# Functions whose runtime-built SQL can't be rendered by dynamic_queries() and is left
+# unaudited on purpose: {"file:function": reason}. Any other dynamic statement fails the audit.
+ALLOWED_DYNAMIC = {}
+
+# EXPLAIN access types that read a whole table or a whole index
+FULL_SCAN_TYPES = {'ALL', 'index'}
+
+
+# Names bound once to a string literal, so `cursor.execute(query, ...)` can be read as well
+def literal_names(statements):
+    names, rebound = {}, set()
+    for node in statements:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str) and name not in names:
+                names[name] = node.value.value
+            else:
+                rebound.add(name)
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name):
+            rebound.add(node.target.id)
+    return {name: value for name, value in names.items() if name not in rebound}
+
+
+# Find the SQL passed to every execute(), stream_query() and iter_rows() call. Returns
+# (location, "file:function", sql) per call, with sql None where it is built at runtime.
+def extract_statements(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+    filename = os.path.basename(path)
+
+    statements = []
+
+    def visit(node, function, names):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            function, names = node.name, {**names, **literal_names(ast.walk(node))}
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            index = SQL_CALLS.get(name)
+            if index is not None and len(node.args) > index:
+                arg = node.args[index]
+                sql = None
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    sql = arg.value
+                elif isinstance(arg, ast.Name):
+                    sql = names.get(arg.id)
+                statements.append((f"{filename}:{node.lineno}", f"{filename}:{function}",
+                                   ' '.join(sql.split()) if sql is not None else None))
+        for child in ast.iter_child_nodes(node):
+            visit(child, function, names)
+
+    visit(tree, '<module>', literal_names(tree.body))
+    return statements
+
+
+# Stands in for a connection: records the SQL it is given and answers every fetch with `rows`
+class RecordingConnection:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+        self.rowcount = 0
+        self.lastrowid = 0
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        if sql not in self.statements:
+            self.statements.append(sql)
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def executemany(self, sql, rows):
+        pass
+
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def recorded(func, *args, rows=()):
+    conn = RecordingConnection(rows)
+    func(conn, *args)
+    return conn.statements
+
+
+# Statements built at runtime, rendered by the same functions the app calls, with arguments
+# that reach every branch; keyed like extract_statements() so each covers its call sites
+def dynamic_queries():
+    from admin_queue import encode_cursor as queue_cursor, get_queue_page, queue_segments, set_request_status
+    from app import ITEM_SORTS, SAVED_ITEMS_SQL, USER_WITH_ITEMS_SQL, items_page_query
+    from bulk_items import export_query
+    from facets import rebuild_facets
+    from item_images import load_item_images
+    from saved import remove_items, save_items
+    from search import SEARCH_SORTS, search_query
+    from storage import referenced_paths
+
+    cursors = {'newest': '100', 'price_asc': '10.00_100', 'price_desc': '10.00_100'}
+    return {
+        'app.py:get_items_page': list(dict.fromkeys(
+            items_page_query(category, sort, after and cursors[sort], 24)[0]
+            for category in (None, 'Books') for sort in ITEM_SORTS for after in (None, True)
+        )),
+        'app.py:get_user_with_items': [USER_WITH_ITEMS_SQL],
+        'app.py:saved_items': [SAVED_ITEMS_SQL],
+        'search.py:search_items': list(dict.fromkeys(
+            search_query(query, min_price=1, max_price=100, quality='Good', category='Books', sort=sort)[0]
+            for query in ('laptop bag', 'tv', None) for sort in SEARCH_SORTS
+        )),
+        'bulk_items.py:export_items': [export_query()[0], export_query(1)[0]],
+        'admin_queue.py:get_queue_page': [
+            sql for segment in range(len(queue_segments('all')))
+            for sql in recorded(lambda cursor: get_queue_page(cursor, 'all', queue_cursor(segment, 100)))
+        ],
+        'admin_queue.py:set_request_status': recorded(set_request_status, ['REF1', 'REF2'], 'Confirmed',
+                                                      rows=[('REF1',)]),
+        'facets.py:rebuild_facets': recorded(rebuild_facets),
+        'item_images.py:load_item_images': recorded(load_item_images, [1, 2]),
+        'saved.py:save_items': recorded(save_items, 1, [1, 2]),
+        'saved.py:remove_items': recorded(remove_items, 1, [1, 2]),
+        'storage.py:referenced_paths': recorded(referenced_paths, ['a', 'b']),
+    }
+
+
+# Fill placeholders with a dummy value so the statement can be explained;
+# LIMIT/OFFSET need a bare integer, everything else takes a string constant
+def bind_placeholders(sql):
+    sql = re.sub(r"\b(LIMIT|OFFSET)\s+%s", r"\1 1", sql, flags=re.IGNORECASE)
+    return sql.replace('%s', "'1'")
+
+
+def explain(cursor, sql):
+    cursor.execute("EXPLAIN " + bind_placeholders(sql))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def audit(conn, base_dir=None):
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    found = []
+    for filename in AUDITED_FILES:
+        found.extend(extract_statements(os.path.join(base_dir, filename)))
+
+    # A function's rendered statements are checked once, under its first dynamic call site
+    dynamic = dynamic_queries()
+    rendered = set()
+    report = []
+    statements = []
+    for location, function, sql in found:
+        if sql is not None:
+            statements.append((location, function, sql))
+        elif function in dynamic:
+            if function not in rendered:
+                rendered.add(function)
+                statements.extend((location, function, statement) for statement in dynamic[function])
+        elif function in ALLOWED_DYNAMIC:
+            report.append((location, 'allowed', f"dynamic SQL: {ALLOWED_DYNAMIC[function]}"))
+        else:
+            report.append((location, 'skipped', f"dynamic SQL in {function} (render it in dynamic_queries())"))
+
+    cursor = conn.cursor()
+    for location, function, sql in statements:
+        if not sql.upper().startswith(('SELECT', 'UPDATE', 'DELETE')) or 'information_schema' in sql:
+            continue
+        plan = explain(cursor, sql)
+        # An index walked in ORDER BY order under a LIMIT stops after LIMIT rows (first pages)
+        bounded = re.search(r"\bLIMIT\s+%s(\s+OFFSET\s+%s)?$", sql, flags=re.IGNORECASE)
+        scans = [row['table'] for row in plan
+                 if row.get('type') == 'ALL' or (row.get('type') in FULL_SCAN_TYPES and not bounded)]
+        if scans and function not in ALLOWED_FULL_SCANS:
+            report.append((location, 'full scan', f"{', '.join(scans)}: {sql}"))
+        else:
+            report.append((location, 'ok', sql))
+    cursor.close()
+    conn.rollback()
+    return report
+
+
+def init_app(app):
+    @app.cli.command('explain-audit')
+    @click.option('--verbose', is_flag=True, help='Also list statements that passed.')
+    def explain_audit_command(verbose):
+        """EXPLAIN every SQL statement in the app and fail on full table scans or unaudited SQL."""
+        report = audit(get_db())
+        scans = [entry for entry in report if entry[1] == 'full scan']
+        skipped = [entry for entry in report if entry[1] == 'skipped']
+        failures = scans + skipped
+        for location, status, detail in report:
+            if status != 'ok' or verbose:
+                click.echo(f"{status:>9}  {location}  {detail}")
+        click.echo(f"{len(report)} statements checked, {len(scans)} full scans, {len(skipped)} not audited")
+        if failures:
+            raise SystemExit(1)
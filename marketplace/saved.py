@@ -0,0 +1,73 @@
+from cache import get_cache
+from db import get_db
+
+# Item ids accepted by one batch save/unsave request (one IN list each)
+MAX_BATCH = 500
+
+
+# Unique item ids from a request's JSON list or repeated form values, in the given order
+def parse_item_ids(values):
+    if not isinstance(values, list):
+        raise ValueError("item_ids must be a list")
+    item_ids = []
+    for value in values:
+        try:
+            item_id = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid item id: {value!r}")
+        if item_id <= 0:
+            raise ValueError(f"Invalid item id: {value!r}")
+        if item_id not in item_ids:
+            item_ids.append(item_id)
+    if len(item_ids) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} items per request")
+    return item_ids
+
+
+# Save items in one statement. Ids of missing items are skipped by the SELECT and already
+# saved ones hit the (user_id, item_id) unique key, which updates nothing, so concurrent
+# saves can't double-insert. Returns how many were newly saved; commit is the caller's.
+def save_items(cursor, user_id, item_ids):
+    if not item_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(item_ids))
+    cursor.execute(
+        f"INSERT INTO saved_items (user_id, item_id) SELECT %s, id FROM items WHERE id IN ({placeholders}) "
+        "ON DUPLICATE KEY UPDATE item_id = saved_items.item_id",
+        (user_id, *item_ids)
+    )
+    return cursor.rowcount
+
+
+# Unsave items in one statement; returns how many were actually removed
+def remove_items(cursor, user_id, item_ids):
+    if not item_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(item_ids))
+    cursor.execute(
+        f"DELETE FROM saved_items WHERE user_id = %s AND item_id IN ({placeholders})",
+        (user_id, *item_ids)
+    )
+    return cursor.rowcount
+
+
+def load_saved_ids(user_id):
+    cursor = get_db().cursor()
+    cursor.execute("SELECT item_id FROM saved_items WHERE user_id = %s", (user_id,))
+    item_ids = frozenset(row[0] for row in cursor.fetchall())
+    cursor.close()
+    return item_ids
+
+
+# The user's saved item ids, cached under the 'saved:<user>' version so grid pages can
+# mark saved cards without a query; bump it with invalidate_saved() after every change
+def get_saved_ids(user_id):
+    if not user_id:
+        return frozenset()
+    cache = get_cache()
+    return cache.get_or_set(f"saved_ids:{user_id}:{cache.version(f'saved:{user_id}')}",
+                            lambda: load_saved_ids(user_id))
+
+
+def invalidate_saved(user_id):
+    get_cache().bump(f'saved:{user_id}')
@@ -0,0 +1,98 @@
+import re
+
+from db import get_db
+
+# InnoDB ignores tokens shorter than innodb_ft_min_token_size (3 by default)
+MIN_TOKEN_LENGTH = 3
+MAX_TOKENS = 8
+MAX_PAGE = 50
+
+# Matches in the item name count for more than matches in the description
+NAME_WEIGHT = 2
+
+SEARCH_SORTS = {
+    'relevance': None,
+    'price-asc': "price ASC, id ASC",
+    'price-desc': "price DESC, id DESC",
+}
+
+SEARCH_COLUMNS = "id, name, price, grid_image, grid_variants, category, quality"
+
+
+# Split free text into lowercase word tokens, dropping boolean-mode operators
+def tokenize(text):
+    tokens = []
+    for token in re.findall(r"\w+", (text or '').lower()):
+        if len(token) >= MIN_TOKEN_LENGTH and token not in tokens:
+            tokens.append(token)
+    return tokens[:MAX_TOKENS]
+
+
+# Every token is required and may be a prefix of a word ("lapt" finds "laptop")
+def build_boolean_query(tokens):
+    return ' '.join(f"+{token}*" for token in tokens)
+
+
+# SQL and parameters for one page of results, one row over per_page to tell if more follow
+def search_query(query, min_price=None, max_price=None, quality=None, category=None,
+                 sort='relevance', page=1, per_page=24):
+    if sort not in SEARCH_SORTS:
+        sort = 'relevance'
+    page = max(1, min(page, MAX_PAGE))
+    tokens = tokenize(query)
+
+    select = [SEARCH_COLUMNS]
+    where = []
+    params = []
+    select_params = []
+
+    if tokens:
+        boolean_query = build_boolean_query(tokens)
+        select.append(
+            f"(MATCH(name) AGAINST (%s IN BOOLEAN MODE) * {NAME_WEIGHT}"
+            " + MATCH(name, description) AGAINST (%s IN BOOLEAN MODE)) AS score"
+        )
+        select_params.extend([boolean_query, boolean_query])
+        where.append("MATCH(name, description) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(boolean_query)
+    elif query and query.strip():
+        # Nothing indexable (e.g. only very short words): fall back to a name prefix match
+        where.append("name LIKE %s")
+        params.append(query.strip().replace('%', r'\%').replace('_', r'\_') + '%')
+
+    # Filters are ANDed with the text match as a whole
+    if min_price is not None:
+        where.append("price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        where.append("price <= %s")
+        params.append(max_price)
+    if quality and quality != 'all':
+        where.append("quality = %s")
+        params.append(quality)
+    if category and category != 'all':
+        where.append("category = %s")
+        params.append(category)
+
+    sql = f"SELECT {', '.join(select)} FROM items"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if sort == 'relevance':
+        sql += " ORDER BY score DESC, id DESC" if tokens else " ORDER BY id DESC"
+    else:
+        sql += f" ORDER BY {SEARCH_SORTS[sort]}"
+    sql += " LIMIT %s OFFSET %s"
+    return sql, tuple(select_params + params + [per_page + 1, (page - 1) * per_page])
+
+
+def search_items(query, min_price=None, max_price=None, quality=None, category=None,
+                 sort='relevance', page=1, per_page=24):
+    sql, params = search_query(query, min_price, max_price, quality, category, sort, page, per_page)
+    conn = get_db()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(sql, params)
+    results = cursor.fetchall()
+    cursor.close()
+
+    has_next = len(results) > per_page
+    return results[:per_page], has_next
@@ -0,0 +1,193 @@
+import os
+import re
+import time
+
+import click
+
+from cache import get_cache
+from db import get_db, stream_query
+
+TOKEN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have in is it its of on or so the this to was with
+    very good great item items condition sale sell selling brand used new price php only
+""".split())
+
+# Term weights per field before TF-IDF; the category counts as one strong term
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+CATEGORY_WEIGHT = 3.0
+
+# Neighbours scored per matrix product (batch x items floats at a time)
+NEIGHBOR_BATCH = 256
+
+
+def item_terms(name, description, category):
+    weights = {}
+    for text, weight in ((name, NAME_WEIGHT), (description, DESCRIPTION_WEIGHT)):
+        for token in TOKEN.findall((text or '').lower()):
+            if len(token) > 1 and token not in STOP_WORDS:
+                weights[token] = weights.get(token, 0) + weight
+    if category:
+        weights['category:' + category] = CATEGORY_WEIGHT
+    return weights
+
+
+# TF-IDF vectors of (id, name, description, category) rows, randomly projected down to
+# `dimensions` floats per item so 100k items fit in ~100MB; cosine similarity is preserved
+# closely enough to rank neighbours. Returns (ids, matrix) with unit-length matrix rows.
+def build_vectors(rows, dimensions=256, max_df=0.5, seed=0):
+    import numpy as np
+
+    ids, indptr, terms, weights = [], [0], [], []
+    vocabulary = {}
+    for item_id, name, description, category in rows:
+        for term, weight in item_terms(name, description, category).items():
+            terms.append(vocabulary.setdefault(term, len(vocabulary)))
+            weights.append(weight)
+        ids.append(item_id)
+        indptr.append(len(terms))
+    count = len(ids)
+    ids = np.array(ids, dtype=np.int64)
+    terms = np.array(terms, dtype=np.int64)
+    weights = np.array(weights, dtype=np.float32)
+    owners = np.repeat(np.arange(count), np.diff(np.array(indptr)))
+
+    # A term in a single item can't relate two items, and one in most items tells none apart
+    df = np.bincount(terms, minlength=len(vocabulary))
+    useful = (df > 1) & (df <= max_df * count)
+    idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+    keep = useful[terms]
+    terms, weights, owners = np.cumsum(useful)[terms[keep]] - 1, weights[keep], owners[keep]
+
+    values = (1 + np.log(weights)) * idf[useful][terms]
+    norms = np.sqrt(np.bincount(owners, values * values, minlength=count)).astype(np.float32)
+    values /= np.where(norms > 0, norms, 1)[owners]
+
+    # Sparse rows times a dense random matrix, a slice of items at a time (entries are
+    # grouped by item, so each item's terms sum with one reduceat)
+    projection = np.random.default_rng(seed).standard_normal((int(useful.sum()), dimensions), dtype=np.float32)
+    matrix = np.zeros((count, dimensions), dtype=np.float32)
+    for start in range(0, count, 4096):
+        low, high = np.searchsorted(owners, [start, start + 4096])
+        if low == high:
+            continue
+        chunk = owners[low:high]
+        starts = np.flatnonzero(np.r_[True, chunk[1:] != chunk[:-1]])
+        matrix[chunk[starts]] = np.add.reduceat(values[low:high, None] * projection[terms[low:high]], starts)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms > 0, norms, 1)
+    return ids, matrix
+
+
+# Top `count` neighbours of each target row (all rows by default) by cosine similarity,
+# best first. Yields (rows, neighbours, scores) per batch so results can be written as they come.
+def nearest_neighbors(matrix, targets=None, count=8, batch=NEIGHBOR_BATCH):
+    import numpy as np
+
+    if targets is None:
+        targets = np.arange(len(matrix))
+    count = min(count, len(matrix) - 1)
+    if count <= 0:
+        return
+    for start in range(0, len(targets), batch):
+        rows = targets[start:start + batch]
+        scores = matrix[rows] @ matrix.T
+        scores[np.arange(len(rows)), rows] = -np.inf
+        top = np.argpartition(scores, -count, axis=1)[:, -count:]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        yield rows, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+# Write neighbour batches to item_similar, one commit per batch so pages keep serving the
+# previous lists meanwhile. Full rebuilds pass every item in id order, so each batch
+# replaces one contiguous id range; incremental runs only target items without rows.
+def store_neighbors(conn, ids, batches, min_score, replace=True):
+    cursor = conn.cursor()
+    written = 0
+    for rows, neighbors, scores in batches:
+        records = [
+            (int(ids[row]), position, int(ids[neighbor]), float(score))
+            for row, row_neighbors, row_scores in zip(rows, neighbors, scores)
+            for position, (neighbor, score) in enumerate(zip(row_neighbors, row_scores))
+            if score >= min_score
+        ]
+        if replace:
+            cursor.execute("DELETE FROM item_similar WHERE item_id BETWEEN %s AND %s",
+                           (int(ids[rows[0]]), int(ids[rows[-1]])))
+        if records:
+            # IGNORE: an item deleted since the vectors were built just loses its rows
+            cursor.executemany(
+                "INSERT IGNORE INTO item_similar (item_id, position, similar_id, score) VALUES (%s, %s, %s, %s)",
+                records
+            )
+        conn.commit()
+        written += len(records)
+    cursor.close()
+    return written
+
+
+# Recompute similar items for the whole catalog, or with missing_only just for items that
+# have none yet (new listings; they show up in older items' lists at the next full rebuild).
+# Returns counts and per-phase seconds.
+def rebuild_similar(conn, count=8, dimensions=256, min_score=0.1, missing_only=False):
+    import numpy as np
+
+    stats = {}
+    started = time.perf_counter()
+    ids, matrix = build_vectors(
+        stream_query("SELECT id, name, description, category FROM items ORDER BY id", dictionary=False),
+        dimensions
+    )
+    stats['items'] = len(ids)
+    stats['vectorize_s'] = time.perf_counter() - started
+
+    targets = None
+    if missing_only:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT i.id FROM items i
+            LEFT JOIN item_similar s ON s.item_id = i.id AND s.position = 0
+            WHERE s.item_id IS NULL
+        """)
+        missing = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        cursor.close()
+        targets = np.flatnonzero(np.isin(ids, missing))
+    stats['targets'] = len(ids) if targets is None else len(targets)
+
+    started = time.perf_counter()
+    stats['rows'] = store_neighbors(conn, ids, nearest_neighbors(matrix, targets, count), min_score,
+                                    replace=not missing_only)
+    stats['neighbors_s'] = time.perf_counter() - started
+    get_cache().bump('similar')
+    return stats
+
+
+# Precomputed neighbours of one item, best first: a primary-key range read joined to items
+def load_similar_items(cursor, item_id):
+    cursor.execute("""
+        SELECT i.id, i.name, i.price, i.grid_image, i.grid_variants, i.category, i.quality
+        FROM item_similar s
+        JOIN items i ON i.id = s.similar_id
+        WHERE s.item_id = %s
+        ORDER BY s.position
+    """, (item_id,))
+    return cursor.fetchall()
+
+
+def init_app(app):
+    # Neighbours kept per item, vector size, and the cosine score below which none is shown
+    app.config.setdefault('SIMILAR_ITEMS_COUNT', int(os.environ.get('SIMILAR_ITEMS_COUNT', 8)))
+    app.config.setdefault('SIMILAR_ITEMS_DIMENSIONS', int(os.environ.get('SIMILAR_ITEMS_DIMENSIONS', 256)))
+    app.config.setdefault('SIMILAR_ITEMS_MIN_SCORE', float(os.environ.get('SIMILAR_ITEMS_MIN_SCORE', 0.1)))
+
+    @app.cli.command('build-similar')
+    @click.option('--missing', is_flag=True, help='Only items without similar items yet (run often; '
+                                                  'a full rebuild also refreshes older lists).')
+    def build_similar_command(missing):
+        """Recompute the similar-items table from item names, descriptions and categories."""
+        stats = rebuild_similar(get_db(), app.config['SIMILAR_ITEMS_COUNT'], app.config['SIMILAR_ITEMS_DIMENSIONS'],
+                                app.config['SIMILAR_ITEMS_MIN_SCORE'], missing_only=missing)
+        click.echo(f"{stats['targets']} of {stats['items']} items: {stats['rows']} rows written "
+                   f"(vectorize {stats['vectorize_s']:.1f}s, neighbours {stats['neighbors_s']:.1f}s)")
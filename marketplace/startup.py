@@ -0,0 +1,114 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+import click
+
+from migrations import pending_migrations
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+# Open pool connections, compile templates and fill the shared caches before a worker
+# accepts traffic (gunicorn's post_worker_init, see gunicorn.conf.py). Every step is
+# best-effort: if MySQL is briefly down the first requests are slower, the boot doesn't fail.
+def warm_up(app):
+    timings = app.extensions.setdefault('startup', {})
+    started = time.perf_counter()
+
+    pool = app.extensions['db_pool']
+    conns = []
+    try:
+        # At least one, which also runs the migration check: asking the pool for another
+        # while all of them are held here would wait out the pool timeout
+        for _ in range(max(1, min(app.config['WARM_UP_CONNECTIONS'], pool.size))):
+            conns.append(pool.acquire())
+        cursor = conns[0].cursor()
+        pending = pending_migrations(cursor)
+        cursor.close()
+        if pending:
+            app.logger.warning("%d schema migrations pending (%s); run `flask migrate`",
+                               len(pending), ', '.join(pending))
+    except Exception:
+        app.logger.exception("Warm-up could not reach the database")
+    finally:
+        for conn in conns:
+            pool.release(conn)
+    timings['warm_up_pool_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+    timings['warm_up_templates_ms'] = (time.perf_counter() - started) * 1000
+
+    # Requests to cheap public pages fill the listing, facet and card caches
+    started = time.perf_counter()
+    client = app.test_client()
+    for path in app.config['WARM_UP_PATHS']:
+        try:
+            response = client.get(path)
+            if response.status_code >= 500:
+                app.logger.warning("Warm-up request %s returned %s", path, response.status_code)
+        except Exception:
+            app.logger.exception("Warm-up request %s failed", path)
+    timings['warm_up_requests_ms'] = (time.perf_counter() - started) * 1000
+
+    app.logger.info("Warm-up done: %s", ', '.join(f"{key} {value:.0f}" for key, value in timings.items()))
+    return timings
+
+
+# Import `module` in a fresh interpreter under -X importtime; returns its total import time
+# and its direct imports as [(milliseconds, name)], slowest first
+def measure_import_time(module='app', cwd=None):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    # Each module is reported after the modules it imported, indented one level deeper
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), int(match.group(2)) / 1000, match.group(4)))
+    for index, (depth, total, name) in enumerate(entries):
+        if name == module and depth == 1:
+            children = []
+            for child_depth, child_total, child_name in reversed(entries[:index]):
+                if child_depth == depth:
+                    break
+                if child_depth == depth + 2:
+                    children.append((child_total, child_name))
+            return total, sorted(children, reverse=True)
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def init_app(app):
+    # Pool connections opened and pages requested by warm_up()
+    app.config.setdefault('WARM_UP_CONNECTIONS', int(os.environ.get('WARM_UP_CONNECTIONS', 2)))
+    app.config.setdefault('WARM_UP_PATHS', [
+        path for path in os.environ.get('WARM_UP_PATHS', '/homepage,/api/items,/api/facets').split(',') if path
+    ])
+    # Ceiling for `flask import-time`, so a new top-level import of a heavy module is caught in CI
+    app.config.setdefault('IMPORT_TIME_BUDGET_MS', int(os.environ.get('IMPORT_TIME_BUDGET_MS', 1000)))
+
+    @app.cli.command('import-time')
+    @click.option('--module', default='app', help='Module to import.')
+    @click.option('--budget-ms', type=int, default=None, help='Fail above this many milliseconds.')
+    @click.option('--top', type=int, default=10, help='Direct imports to list.')
+    def import_time_command(module, budget_ms, top):
+        """Measure the cold import time of the app against the startup budget."""
+        budget_ms = app.config['IMPORT_TIME_BUDGET_MS'] if budget_ms is None else budget_ms
+        try:
+            total, children = measure_import_time(module, cwd=app.root_path)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        for ms, name in children[:top]:
+            click.echo(f"{ms:8.1f}ms  {name}")
+        click.echo(f"import {module}: {total:.1f}ms (budget {budget_ms}ms)")
+        if total > budget_ms:
+            raise click.ClickException(f"import time is over budget by {total - budget_ms:.1f}ms")
@@ -0,0 +1,181 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from throttle import gevent_patched
+
+# Statuses after which nothing more will be sent for a reference
+FINAL_STATUSES = {'Confirmed', 'Rejected'}
+
+
+# A waiting client's inbox for one reference type
+class Subscription:
+    def __init__(self, key):
+        self.key = key
+        self._queue = queue.SimpleQueue()
+
+    def put(self, status):
+        self._queue.put(status)
+
+    # Next status, or None if nothing arrives within `timeout` seconds
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# Local stand-in for a cross-worker channel (same interface as RedisBus); delivers in-process only
+class LocalBus:
+    def start(self, handler):
+        self.handler = handler
+
+    def publish(self, key, status):
+        self.handler(key, status)
+
+
+# Fan-out through Redis pub/sub so a status changed in one worker reaches clients waiting
+# on any worker; the redis package is only needed when this bus is configured
+class RedisBus:
+    def __init__(self, url, channel='marketplace:status'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def start(self, handler):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+
+        def listen():
+            for message in pubsub.listen():
+                try:
+                    event = json.loads(message['data'])
+                    handler(event['reference_type'], event['status'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+        threading.Thread(target=listen, name='status-events', daemon=True).start()
+
+    def publish(self, key, status):
+        self.client.publish(self.channel, json.dumps({'reference_type': key, 'status': status}))
+
+
+# In-process pub/sub of payment status changes, keyed by reference type.
+# Waiting clients block on their Subscription and cost no queries until a change arrives.
+class StatusBroker:
+    def __init__(self, bus):
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._subscribers = {}  # reference type -> set of Subscription
+        self.waiting = 0
+        self.published = 0
+        self.delivered = 0
+        bus.start(self.dispatch)
+
+    # Returns None instead when `limit` clients are already waiting in this process
+    def subscribe(self, key, limit=None):
+        subscription = Subscription(key)
+        with self._lock:
+            if limit is not None and self.waiting >= limit:
+                return None
+            self._subscribers.setdefault(key, set()).add(subscription)
+            self.waiting += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.discard(subscription)
+                self.waiting -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def publish(self, key, status):
+        with self._lock:
+            self.published += 1
+        self.bus.publish(key, status)
+
+    # Called by the bus for every change, including those published by other workers
+    def dispatch(self, key, status):
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+            self.delivered += len(subscribers)
+        for subscription in subscribers:
+            subscription.put(status)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'references': len(self._subscribers),
+                'subscribers': self.waiting,
+                'published': self.published,
+                'delivered': self.delivered,
+            }
+
+
+def sse_event(data, event='status'):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Server-sent event stream for one subscription: the current status first, then every
+# change until a final status or `timeout`; comment lines keep idle proxies from closing it
+def stream_status(broker, subscription, initial, timeout, heartbeat):
+    try:
+        yield "retry: 3000\n\n"
+        yield sse_event(initial)
+        if 'error' in initial or initial['status'] in FINAL_STATUSES:
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            status = subscription.get(timeout=min(heartbeat, remaining))
+            if status is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event({'status': status})
+            if status in FINAL_STATUSES:
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def init_app(app):
+    app.config.setdefault('STATUS_EVENTS_BACKEND', os.environ.get('STATUS_EVENTS_BACKEND', 'local'))
+    app.config.setdefault('STATUS_EVENTS_REDIS_URL', os.environ.get('STATUS_EVENTS_REDIS_URL', 'redis://localhost:6379/0'))
+    # How long one stream (or long-poll) stays open before the client reconnects, and the keep-alive interval
+    app.config.setdefault('STATUS_EVENTS_TIMEOUT', int(os.environ.get('STATUS_EVENTS_TIMEOUT', 300)))
+    app.config.setdefault('STATUS_EVENTS_HEARTBEAT', int(os.environ.get('STATUS_EVENTS_HEARTBEAT', 15)))
+    # A waiting client only costs nothing on cooperative (ASYNC_MODE=gevent) workers. On threaded
+    # workers each one holds one of the worker's few threads, so there /status_events is off,
+    # clients long-poll for at most STATUS_EVENTS_THREADED_WAIT seconds at a time, and at most
+    # STATUS_EVENTS_MAX_WAITING of them wait at once per process
+    streaming = gevent_patched()
+    app.config.setdefault('STATUS_EVENTS_STREAMING', streaming)
+    app.config.setdefault('STATUS_EVENTS_THREADED_WAIT', float(os.environ.get('STATUS_EVENTS_THREADED_WAIT', 5)))
+    app.config.setdefault('STATUS_EVENTS_MAX_WAITING',
+                          int(os.environ.get('STATUS_EVENTS_MAX_WAITING', 1000 if streaming else 2)))
+
+    if app.config['STATUS_EVENTS_BACKEND'] == 'redis':
+        bus = RedisBus(app.config['STATUS_EVENTS_REDIS_URL'])
+    else:
+        bus = LocalBus()
+    app.extensions['status_events'] = StatusBroker(bus)
+
+
+def get_broker():
+    return current_app.extensions['status_events']
+
+
+# Longest a /check_status long-poll may wait in this process
+def max_wait():
+    config = current_app.config
+    if config['STATUS_EVENTS_STREAMING']:
+        return config['STATUS_EVENTS_TIMEOUT']
+    return min(config['STATUS_EVENTS_THREADED_WAIT'], config['STATUS_EVENTS_TIMEOUT'])
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+import click
+
+from db import get_db
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Content-addressed file store: each distinct upload is written once under its SHA-256
+class BlobStore:
+    def __init__(self, root='static/uploads/blobs', static_folder='static'):
+        self.root = root
+        self.static_folder = static_folder
+        self.tmp = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+        self.prefix = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        self.url_pattern = re.compile(
+            rf"^/static/{re.escape(self.prefix)}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.\w+)?$"
+        )
+
+    # Sharded by the first two byte pairs so no directory grows too large
+    def path_for(self, digest, extension=''):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + extension)
+
+    # Stream the file to disk while hashing it; returns the path relative to static/
+    def put(self, file, filename=''):
+        extension = os.path.splitext(filename)[1].lower()
+        if not re.fullmatch(r"\.\w{1,10}", extension):
+            extension = ''
+        stream = getattr(file, 'stream', file)
+        stream.seek(0)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            path = self.path_for(digest.hexdigest(), extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                # Already stored: keep the existing copy and refresh it so GC treats it as fresh
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+
+    def url_for(self, relpath):
+        return '/static/' + relpath
+
+    # Map a /static/... URL back to its blob path, or None for anything not in this store
+    def relpath_from_url(self, url):
+        if url and self.url_pattern.match(url):
+            return url[len('/static/'):]
+        return None
+
+    def contains(self, relpath):
+        return relpath.startswith(self.prefix + '/') and not relpath.startswith(self.prefix + '/tmp/')
+
+    def delete(self, relpath):
+        try:
+            os.remove(os.path.join(self.static_folder, relpath))
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if os.path.abspath(dirpath) == os.path.abspath(self.tmp):
+                dirnames[:] = []
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, self.static_folder).replace(os.sep, '/'), path
+
+
+# Record that an item or proof uses the given blobs (URLs or static-relative paths)
+def add_refs(cursor, store, owner_type, owner_id, paths):
+    rows = []
+    for path in paths:
+        if path and path.startswith('/static/'):
+            path = store.relpath_from_url(path)
+        if path and store.contains(path):
+            rows.append((path, owner_type, owner_id))
+    if rows:
+        cursor.executemany(
+            "INSERT IGNORE INTO blob_refs (path, owner_type, owner_id) VALUES (%s, %s, %s)",
+            rows
+        )
+
+
+# Drop an owner's references; returns the blob paths it held
+def release_refs(cursor, owner_type, owner_id):
+    cursor.execute(
+        "SELECT path FROM blob_refs WHERE owner_type = %s AND owner_id = %s",
+        (owner_type, owner_id)
+    )
+    paths = [row[0] for row in cursor.fetchall()]
+    if paths:
+        cursor.execute(
+            "DELETE FROM blob_refs WHERE owner_type = %s AND owner_id = %s",
+            (owner_type, owner_id)
+        )
+    return paths
+
+
+# The subset of paths that still have at least one reference
+def referenced_paths(cursor, paths):
+    referenced = set()
+    for start in range(0, len(paths), 500):
+        batch = paths[start:start + 500]
+        cursor.execute(
+            f"SELECT DISTINCT path FROM blob_refs WHERE path IN ({', '.join(['%s'] * len(batch))})",
+            tuple(batch)
+        )
+        referenced.update(row[0] for row in cursor.fetchall())
+    return referenced
+
+
+# Delete blobs nobody references. Blobs touched within `grace` seconds are kept,
+# since an upload in flight may have stored them without recording its reference yet.
+def collect_garbage(conn, store, paths=None, grace=120):
+    if paths is None:
+        paths = [relpath for relpath, _ in store.iter_blobs()]
+    if not paths:
+        return []
+
+    cursor = conn.cursor()
+    referenced = referenced_paths(cursor, paths)
+    cursor.close()
+
+    removed = []
+    cutoff = time.time() - grace
+    for relpath in paths:
+        if relpath in referenced:
+            continue
+        full_path = os.path.join(store.static_folder, relpath)
+        try:
+            if os.path.getmtime(full_path) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        store.delete(relpath)
+        removed.append(relpath)
+    return removed
+
+
+def init_app(app):
+    app.config.setdefault('BLOB_ROOT', os.environ.get('BLOB_ROOT', 'static/uploads/blobs'))
+    app.config.setdefault('BLOB_GC_GRACE', int(os.environ.get('BLOB_GC_GRACE', 120)))
+    store = BlobStore(app.config['BLOB_ROOT'])
+    app.extensions['blob_store'] = store
+
+    @app.cli.command('gc-blobs')
+    @click.option('--grace', type=int, default=None, help='Keep blobs modified in the last N seconds.')
+    def gc_blobs_command(grace):
+        """Delete stored uploads that no item or proof references."""
+        grace = app.config['BLOB_GC_GRACE'] if grace is None else grace
+        removed = collect_garbage(get_db(), store, grace=grace)
+        for relpath in removed:
+            click.echo(f"Removed {relpath}")
+        click.echo(f"{len(removed)} unreferenced blobs removed")
@@ -0,0 +1,119 @@
+import os
+import sys
+
+import pytest
+from mysql.connector import Error
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as marketplace  # noqa: E402
+from migrations import migrate  # noqa: E402
+from throttle import LocalLimiter  # noqa: E402
+
+# Children first, so foreign keys don't block the cleanup
+TABLES = ['item_similar', 'item_images', 'saved_items', 'blob_refs', 'item_facets', 'import_jobs',
+          'status_history', 'handle_request', 'items', 'users']
+
+
+# The app is configured once per session (create_app reuses the module's app). Tests that
+# need MySQL take the `database` fixture: it uses TEST_DB_NAME (DB_HOST, DB_USER and
+# DB_PASSWORD as for the app), migrates it, and skips the test when it can't be reached.
+@pytest.fixture(scope='session')
+def app():
+    return marketplace.create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'DB_NAME': os.environ.get('TEST_DB_NAME', 'marketplace_test'),
+        'DB_POOL_SIZE': 4,
+        'DB_POOL_TIMEOUT': 2,
+        'UPLOAD_BACKEND': 'local',
+    })
+
+
+@pytest.fixture(scope='session')
+def migrated(app):
+    pool = app.extensions['db_pool']
+    try:
+        conn = pool.acquire()
+    except (Error, ImportError) as e:
+        pytest.skip(f"test database not available: {e}")
+    try:
+        migrate(conn)
+    finally:
+        pool.release(conn)
+    return pool
+
+
+# Every test starts with cold caches and full rate-limit buckets
+@pytest.fixture(autouse=True)
+def fresh_state(app, monkeypatch):
+    clear_caches(app)
+    monkeypatch.setitem(app.extensions, 'rate_limiter', LocalLimiter())
+
+
+def clear_caches(app):
+    app.extensions['cache'].local.clear()
+    app.extensions['user_cache'].clear()
+
+
+# The pool of the migrated test database; every table is emptied after the test
+@pytest.fixture
+def database(migrated):
+    yield migrated
+    with migrated.connection() as conn:
+        cursor = conn.cursor()
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+        cursor.close()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seller(database):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO users (first_name, last_name, username, email, password) VALUES (%s, %s, %s, %s, %s)",
+            ('Sam', 'Seller', 'seller', 'seller@example.com', generate_password_hash('secret'))
+        )
+        user_id = cursor.lastrowid
+        conn.commit()
+        cursor.close()
+    return user_id
+
+
+# Sign the client in as user_id the way the login route does, without a password round trip
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+        session['user_id'] = user_id
+
+
+# Insert `count` listings for user_id, each with `images` detail images; returns their ids
+def add_items(database, user_id, count, images=0):
+    item_ids = []
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        for n in range(count):
+            cursor.execute(
+                "INSERT INTO items (name, price, description, quality, category, meetup_place, seller_phone, "
+                "grid_image, user_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (f"Item {n}", 100 + n, "A test listing", 'used_good', 'Books', 'Library', '09170000000',
+                 '/static/uploads/grid/test.jpg', user_id)
+            )
+            item_ids.append(cursor.lastrowid)
+            for position in range(images):
+                cursor.execute(
+                    "INSERT INTO item_images (item_id, position, url, width, height) VALUES (%s, %s, %s, %s, %s)",
+                    (item_ids[-1], position, f'/static/uploads/detail/test{position}.jpg', 800, 600)
+                )
+        conn.commit()
+        cursor.close()
+    return item_ids
@@ -0,0 +1,80 @@
+import io
+import json
+import time
+
+import pytest
+
+from bulk_items import RowError, check_public_url, importer_for, parse_rows, validate_row
+from conftest import log_in
+
+VALID = {
+    'name': 'Desk lamp', 'price': '350', 'description': 'Works fine', 'quality': 'used_good',
+    'category': 'Home', 'meetup_place': 'Library', 'seller_phone': '09170000000',
+}
+
+
+@pytest.mark.parametrize('changes, error', [
+    ({'name': ''}, "name is required"),
+    ({'price': 'cheap'}, "price must be a number"),
+    ({'price': '-1'}, "price is out of range"),
+    ({'quality': 'mint'}, "quality must be one of"),
+    ({'seller_phone': '0' * 16}, "seller_phone is longer than 15 characters"),
+    ({'description': '\u00e9' * 40000}, "description is longer than 65535 bytes"),
+    ({'grid_image': 'ftp://example.com/a.jpg'}, "unsupported image URL"),
+    ({'detail_images': '|'.join(f'https://example.com/{n}.jpg' for n in range(11))}, "at most 10 detail images"),
+])
+def test_invalid_rows_are_rejected(changes, error):
+    with pytest.raises(RowError, match=error):
+        validate_row({**VALID, **changes})
+
+
+def test_valid_row_is_cleaned():
+    row = validate_row({**VALID, 'price': ' 350.5 ', 'detail_images': 'https://example.com/a.jpg|'})
+    assert str(row['price']) == '350.50'
+    assert row['detail_images'] == ['https://example.com/a.jpg']
+
+
+def test_unparseable_jsonl_lines_are_reported_by_line():
+    lines = [json.dumps(VALID), '{not json', '', '[1, 2]']
+    rows = list(parse_rows(io.BytesIO('\n'.join(lines).encode()), 'jsonl'))
+    assert [line_no for line_no, _ in rows] == [1, 2, 4]
+    assert rows[0][1] == VALID
+    assert isinstance(rows[1][1], RowError) and isinstance(rows[2][1], RowError)
+
+
+@pytest.mark.parametrize('url', ['http://127.0.0.1/a.jpg', 'http://10.0.0.5/a.jpg', 'http://169.254.169.254/',
+                                 'http://[::ffff:127.0.0.1]/a.jpg', 'file:///etc/passwd'])
+def test_images_on_internal_addresses_are_refused(url):
+    with pytest.raises(RowError):
+        check_public_url(url)
+
+
+def test_report_lists_every_invalid_row(app):
+    importer = importer_for(app, user_id=1)
+    # No row is valid, so nothing reaches the database
+    report = importer.run(None, [(2, {**VALID, 'price': 'x'}), (3, RowError("invalid JSON")), (4, {})])
+    assert report['imported'] == 0
+    assert report['failed'] == 3
+    assert [error['line'] for error in report['errors']] == [2, 3, 4]
+
+
+def wait_for_job(client, status_url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_web_import_reports_invalid_rows(client, database, seller):
+    log_in(client, seller)
+    rows = [VALID, {**VALID, 'quality': 'mint'}, {**VALID, 'name': ''}]
+    data = '\n'.join(json.dumps(row) for row in rows).encode()
+    response = client.post('/import_items', data={'file': (io.BytesIO(data), 'items.jsonl')})
+    assert response.status_code == 202
+
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert job['status'] == 'done'
+    assert (job['imported'], job['failed']) == (1, 2)
+    assert [error['line'] for error in job['errors']] == [2, 3]
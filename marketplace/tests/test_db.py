@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+from mysql.connector import Error
+
+import db
+from db import ConnectionPool, PoolExhausted
+
+
+class FakeConnection:
+    def __init__(self):
+        self.rollbacks = 0
+        self.closed = False
+        self.broken = False
+
+    def rollback(self):
+        if self.broken:
+            raise Error(msg="Lost connection to MySQL server")
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        pass
+
+    def is_connected(self):
+        return not self.broken
+
+    def close(self):
+        self.closed = True
+
+
+# The pool logic on its own: every connection it opens is a FakeConnection, kept here
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+
+    def connect(**kwargs):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(db.mysql.connector, 'connect', connect)
+    return connections
+
+
+def test_released_connection_is_reused(opened):
+    pool = ConnectionPool({}, size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert len(opened) == 1
+    assert conn.rollbacks == 1  # the next borrower gets a fresh snapshot
+    stats = pool.stats()
+    assert (stats['checkouts'], stats['checkins'], stats['in_use']) == (2, 1, 1)
+
+
+def test_acquire_times_out_when_every_connection_is_checked_out(opened):
+    pool = ConnectionPool({}, size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolExhausted):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    assert len(opened) == 1
+
+
+def test_release_hands_the_connection_to_a_waiting_acquire(opened):
+    pool = ConnectionPool({}, size=1, timeout=2)
+    conn = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, (conn,))
+    timer.start()
+    assert pool.acquire() is conn
+    timer.join()
+    assert pool.stats()['exhausted'] == 1
+
+
+def test_connection_that_cannot_roll_back_is_discarded(opened):
+    pool = ConnectionPool({}, size=1)
+    conn = pool.acquire()
+    conn.broken = True
+    pool.release(conn)
+    assert conn.closed
+    assert pool.acquire() is not conn
+    assert len(opened) == 2
+
+
+def test_connection_block_releases_on_error(opened):
+    pool = ConnectionPool({}, size=1)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("boom")
+    assert pool.stats()['in_use'] == 0
+
+
+def test_request_connection_is_checked_out_once_and_released_at_teardown(app, opened, monkeypatch):
+    pool = ConnectionPool({}, size=1)
+    monkeypatch.setitem(app.extensions, 'db_pool', pool)
+    with app.test_request_context('/'):
+        assert db.get_db() is db.get_db()
+        assert pool.stats()['in_use'] == 1
+    assert pool.stats()['in_use'] == 0
+    assert pool.stats()['checkouts'] == 1
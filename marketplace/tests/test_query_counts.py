@@ -0,0 +1,49 @@
+from conftest import add_items, clear_caches, log_in
+
+# Queries a page may run with nothing cached, including loading the signed-in user. The
+# counts must not depend on how many listings or images there are (no N+1 loops).
+MAIN_INDEX_QUERIES = 4  # user, listing page, facet summary, saved ids
+USER_INFO_QUERIES = 2  # user, profile joined with the user's listings
+ITEM_DETAIL_QUERIES = 3  # item with seller, its images, similar items
+
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    response.get_data()  # a streamed page returns its connection once fully read
+    return int(response.headers['X-Query-Count'])
+
+
+def test_main_index(app, client, database, seller):
+    log_in(client, seller)
+    add_items(database, seller, 2, images=1)
+    few = query_count(client, '/main_index')
+    assert few <= MAIN_INDEX_QUERIES
+
+    add_items(database, seller, 20, images=3)
+    clear_caches(app)
+    assert query_count(client, '/main_index') == few
+
+    # Listings, facets and the user all come from the cache now
+    assert query_count(client, '/main_index') == 0
+
+
+def test_user_info(app, client, database, seller):
+    log_in(client, seller)
+    add_items(database, seller, 2)
+    few = query_count(client, '/user_info')
+    assert few <= USER_INFO_QUERIES
+
+    add_items(database, seller, 20)
+    clear_caches(app)
+    assert query_count(client, '/user_info') == few
+
+
+def test_item_detail(client, database, seller):
+    few_images, many_images = add_items(database, seller, 1, images=1) + add_items(database, seller, 1, images=8)
+    few = query_count(client, f'/item/{few_images}')
+    assert few <= ITEM_DETAIL_QUERIES
+    assert query_count(client, f'/item/{many_images}') == few
+
+    # The rendered page is cached until the item changes
+    assert query_count(client, f'/item/{few_images}') == 0
@@ -0,0 +1,69 @@
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from throttle import LocalLimiter, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate('10/60') == (10, 10 / 60)
+
+
+def test_bucket_refuses_once_empty():
+    limiter = LocalLimiter()
+    bucket = [('login_ip:203.0.113.7', 2, 1 / 60)]
+    assert limiter.hit(bucket) == [0]
+    assert limiter.hit(bucket) == [0]
+    [wait] = limiter.hit(bucket)
+    assert 0 < wait <= 60
+
+
+def test_refused_attempt_takes_nothing_from_other_buckets():
+    limiter = LocalLimiter()
+    ip = ('login_ip:203.0.113.7', 1, 1 / 60)
+    assert limiter.hit([ip, ('login_email:a@example.com', 5, 5 / 60)]) == [0, 0]
+    # The IP bucket is empty, so b@example.com's bucket must stay full
+    waits = limiter.hit([ip, ('login_email:b@example.com', 1, 1 / 60)])
+    assert waits[0] > 0 and waits[1] == 0
+    assert limiter.hit([('login_email:b@example.com', 1, 1 / 60)]) == [0]
+
+
+# With a capacity of 0 a rule refuses every attempt, before any database or hashing work
+def limit(app, monkeypatch, rule):
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {**app.config['RATE_LIMITS'], rule: (0, 1 / 60)})
+
+
+@pytest.mark.parametrize('rule', ['login_ip', 'login_email'])
+def test_login_is_refused_with_retry_after(app, client, monkeypatch, rule):
+    limit(app, monkeypatch, rule)
+    response = client.post('/login', data={'email': 'a@example.com', 'password': 'secret'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '60'
+
+
+@pytest.mark.parametrize('rule', ['register_ip', 'register_email'])
+def test_register_is_refused_with_retry_after(app, client, monkeypatch, rule):
+    limit(app, monkeypatch, rule)
+    response = client.post('/register', data={
+        'first_name': 'Ann', 'last_name': 'Buyer', 'username': 'ann', 'email': 'ann@example.com',
+        'password': 'secret', 'confirm_password': 'secret',
+    })
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '60'
+
+
+def test_forwarded_address_is_ignored_unless_proxies_are_trusted(app, client, monkeypatch):
+    limit(app, monkeypatch, 'login_ip')
+    client.post('/login', data={'email': 'a@example.com', 'password': 'secret'},
+                headers={'X-Forwarded-For': '203.0.113.7'})
+    buckets = app.extensions['rate_limiter']._buckets
+    assert 'login_ip:127.0.0.1' in buckets and 'login_ip:203.0.113.7' not in buckets
+
+
+def test_limits_are_keyed_on_the_forwarded_client_address_behind_a_trusted_proxy(app, client, monkeypatch):
+    # What init_app sets up for TRUSTED_PROXIES=1
+    monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 1)
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    limit(app, monkeypatch, 'login_ip')
+    client.post('/login', data={'email': 'a@example.com', 'password': 'secret'},
+                headers={'X-Forwarded-For': '203.0.113.7'})
+    assert 'login_ip:203.0.113.7' in app.extensions['rate_limiter']._buckets
@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import metrics
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# "count/seconds", e.g. "10/60": bursts of up to `count`, refilled at count/seconds per second
+def parse_rate(rate):
+    count, seconds = rate.split('/')
+    count, seconds = float(count), float(seconds)
+    return count, count / seconds
+
+
+# In-process token buckets (same interface as RedisLimiter); each worker keeps its own
+# counts, so the effective limit is per worker. Idle keys are evicted oldest first.
+class LocalLimiter:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    # buckets are (key, capacity, refill_rate). A token is taken from every bucket only if
+    # each has one; returns the seconds until each bucket has a token (0 where it has one now)
+    def hit(self, buckets):
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, capacity, refill_rate in buckets:
+                tokens, updated_at = self._buckets.pop(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated_at) * refill_rate))
+            allowed = all(tokens >= 1 for tokens in levels)
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return [max(0, (1 - tokens) / refill_rate) for tokens, (_, _, refill_rate) in zip(levels, buckets)]
+
+
+# Token buckets in Redis, shared by every worker; the refills, the check and the take run
+# atomically in a script. The redis package is only needed when this backend is configured.
+class RedisLimiter:
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    local allowed = true
+    for i, key in ipairs(KEYS) do
+        local capacity, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+        local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+        local tokens = tonumber(state[1]) or capacity
+        local updated_at = tonumber(state[2]) or now
+        levels[i] = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+        if levels[i] < 1 then
+            allowed = false
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        local capacity, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+        local tokens = levels[i]
+        if allowed then
+            tokens = tokens - 1
+        end
+        redis.call('HSET', key, 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+        levels[i] = tostring(levels[i])
+    end
+    return levels
+    """
+
+    def __init__(self, url, prefix='marketplace:ratelimit:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def hit(self, buckets):
+        args = [time.time()]
+        for _, capacity, refill_rate in buckets:
+            args.extend([capacity, refill_rate])
+        levels = self.script(keys=[self.prefix + key for key, _, _ in buckets], args=args)
+        return [max(0, (1 - float(tokens)) / refill_rate) for tokens, (_, _, refill_rate) in zip(levels, buckets)]
+
+
+# Take a token from each named rule's bucket, e.g. check_limits(('login_ip', ip), ...), but
+# only if none is empty, so a denied attempt doesn't use up the other buckets.
+# Returns the seconds to wait if any bucket is empty, else None.
+def check_limits(*rules):
+    app = current_app
+    buckets = [(f"{rule}:{value}",) + app.config['RATE_LIMITS'][rule] for rule, value in rules]
+    waits = app.extensions['rate_limiter'].hit(buckets)
+    retry_after = None
+    for (rule, _), wait in zip(rules, waits):
+        if wait > 0:
+            metrics.count('marketplace_rate_limited_total', rule=rule)
+            retry_after = max(retry_after or 0, wait)
+    return retry_after
+
+
+def gevent_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+
+# Runs password hashing (deliberately CPU-heavy) on a few dedicated threads, so at most
+# `workers` hashes run at once per process whatever the number of request threads; at most
+# `max_pending` may wait, and callers beyond that get HasherBusy instead of queueing.
+class PasswordHasher:
+    def __init__(self, workers=2, max_pending=16, timeout=10):
+        if gevent_patched():
+            # Native threads: a hash on a greenlet would block every other request
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            self.executor = NativeThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self._done()
+            raise
+        # The slot is held until the hash finishes, even if the caller stops waiting
+        future.add_done_callback(lambda _: self._done())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def gauges(self):
+        with self._lock:
+            return [('marketplace_password_hash_in_flight', self.in_flight)]
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMIT_BACKEND', os.environ.get('RATE_LIMIT_BACKEND', 'local'))
+    app.config.setdefault('RATE_LIMIT_REDIS_URL', os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'))
+    # Per rule "count/seconds": login attempts and sign-ups per client IP and per email
+    app.config.setdefault('RATE_LIMITS', {
+        'login_ip': parse_rate(os.environ.get('LOGIN_RATE_LIMIT_IP', '20/60')),
+        'login_email': parse_rate(os.environ.get('LOGIN_RATE_LIMIT_EMAIL', '5/60')),
+        'register_ip': parse_rate(os.environ.get('REGISTER_RATE_LIMIT_IP', '5/3600')),
+        'register_email': parse_rate(os.environ.get('REGISTER_RATE_LIMIT_EMAIL', '3/3600')),
+    })
+    # Reverse proxies in front of the app. Off by default, since gunicorn binds the app directly
+    # and a client could then pick its own address (and fresh rate-limit buckets) per request;
+    # behind N proxies set it to N to read the client from the X-Forwarded-For they add
+    app.config.setdefault('TRUSTED_PROXIES', int(os.environ.get('TRUSTED_PROXIES', 0)))
+    # Concurrent password hashes per process, and how many more may wait for one
+    app.config.setdefault('PASSWORD_HASH_WORKERS', int(os.environ.get('PASSWORD_HASH_WORKERS', 2)))
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16)))
+
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+    if app.config['RATE_LIMIT_BACKEND'] == 'redis':
+        app.extensions['rate_limiter'] = RedisLimiter(app.config['RATE_LIMIT_REDIS_URL'])
+    else:
+        app.extensions['rate_limiter'] = LocalLimiter()
+    hasher = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_MAX_PENDING'])
+    app.extensions['password_hasher'] = hasher
+    app.extensions.setdefault('metrics_gauges', []).append(hasher.gauges)
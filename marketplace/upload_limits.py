@@ -0,0 +1,76 @@
+import os
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, abort, current_app, request
+
+MB = 1024 * 1024
+
+# Leading bytes of each accepted image type; the browser-supplied extension is not trusted
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+# Spool uploaded files in memory up to UPLOAD_SPOOL_THRESHOLD, then to a temp file on disk
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_THRESHOLD'], mode='rb+')
+
+
+# Return the real image type from the file's first bytes, or None if it isn't one we accept
+def sniff_image_type(file):
+    stream = file.stream
+    stream.seek(0)
+    head = stream.read(16)
+    stream.seek(0)
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def file_size(file):
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+# An upload is accepted if it is non-empty, within the per-file cap and really an image
+def validate_image(file, max_size):
+    if not file or not file.filename:
+        return False
+    size = file_size(file)
+    return 0 < size <= max_size and sniff_image_type(file) is not None
+
+
+# Per-endpoint body limits, applied before the form is parsed so oversized uploads
+# are refused from the Content-Length header or cut off mid-stream
+def apply_request_limit():
+    limit = current_app.config['UPLOAD_ENDPOINT_LIMITS'].get(request.endpoint)
+    if limit is None:
+        return
+    request.max_content_length = limit
+    if request.content_length is not None and request.content_length > limit:
+        abort(413)
+
+
+def init_app(app):
+    app.config.setdefault('UPLOAD_SPOOL_THRESHOLD', int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 512 * 1024)))
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        # Flask defaults this to None (unlimited); cap every other endpoint too
+        app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 50 * MB))
+    app.config.setdefault('UPLOAD_MAX_FILE_SIZE', int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 10 * MB)))
+    app.config.setdefault('UPLOAD_ENDPOINT_LIMITS', {
+        'post_item': 50 * MB,
+        'submit_proof': 10 * MB,
+        'update_profile_picture': 5 * MB,
+        'import_items': 50 * MB,
+    })
+
+    app.request_class = UploadRequest
+    app.before_request(apply_request_limit)
@@ -0,0 +1,273 @@
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from images import make_derivatives, collect_variants, variant_urls, image_size
+from item_images import save_item_images
+from storage import add_refs
+
+
+class UploadError(Exception):
+    pass
+
+
+# Uploads to Cloudinary and returns the secure URL; the SDK is only imported when this
+# backend is configured
+class CloudinaryBackend:
+    def __init__(self):
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET')
+        )
+        self.uploader = cloudinary.uploader
+
+    def upload(self, file, timeout=None, **options):
+        if timeout is not None:
+            options['timeout'] = timeout
+        return self.uploader.upload(file, **options)['secure_url']
+
+
+# Local stand-in for Cloudinary: stores files in the content-addressed blob store under static/
+class LocalBackend:
+    def __init__(self, store):
+        self.store = store
+
+    def upload(self, file, timeout=None, **options):
+        if isinstance(file, str):
+            with open(file, 'rb') as src:
+                relpath = self.store.put(src, file)
+        else:
+            relpath = self.store.put(file, file.filename)
+        return self.store.url_for(relpath)
+
+
+BACKENDS = {
+    'cloudinary': CloudinaryBackend,
+    'local': LocalBackend,
+}
+
+
+class Uploader:
+    def __init__(self, backend, max_workers=4, timeout=30, retries=2, backoff=0.5, logger=None):
+        self.backend = backend
+        # Uploads also run on background threads, outside any app context
+        self.logger = logger or logging.getLogger(__name__)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Bounded pool shared by every request so concurrent posts can't multiply upload threads
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload')
+
+    def upload_one(self, file, **options):
+        for attempt in range(self.retries + 1):
+            try:
+                if hasattr(file, 'stream'):
+                    file.stream.seek(0)
+                return self.backend.upload(file, timeout=self.timeout, **options)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise UploadError(f"Upload of {getattr(file, 'filename', file)} failed: {e}")
+                time.sleep(self.backoff * (2 ** attempt))
+
+    # Upload all files concurrently; returns URLs in input order (None for failures)
+    def upload_many(self, files, **options):
+        futures = [self.executor.submit(self.upload_one, file, **options) for file in files]
+        # Budget the whole batch as if every retry of the slowest file ran to its timeout, once
+        # per round of files the workers get through (more files than workers queue up)
+        per_file = self.timeout * (self.retries + 1) + self.backoff * 2 ** self.retries
+        wait(futures, timeout=per_file * math.ceil(len(futures) / self.max_workers))
+        urls = []
+        for future in futures:
+            if future.done() and future.exception() is None:
+                urls.append(future.result())
+            else:
+                if future.done():
+                    self.logger.warning("Error uploading image: %s", future.exception())
+                else:
+                    future.cancel()
+                    self.logger.warning("Error uploading image: timed out")
+                urls.append(None)
+        return urls
+
+
+# Copy request files to temp paths so they outlive the request for background upload
+def spool_files(files):
+    paths = []
+    for file in files:
+        suffix = os.path.splitext(file.filename)[1]
+        fd, path = tempfile.mkstemp(prefix='upload_', suffix=suffix)
+        with os.fdopen(fd, 'wb') as dst:
+            file.stream.seek(0)
+            shutil.copyfileobj(file.stream, dst)
+        paths.append(path)
+    return paths
+
+
+# Background job queue: accepts a listing immediately and fills in its images when uploads finish.
+# A job whose uploads fail is tried again `retries` times, `retry_delay` seconds apart and
+# doubling; the listing is left as it is meanwhile, and a job that still fails is logged.
+class UploadQueue:
+    def __init__(self, uploader, pool, store, on_update=None, workers=2, retries=3, retry_delay=30):
+        self.uploader = uploader
+        self.pool = pool
+        self.store = store
+        self.on_update = on_update  # Called with the item id once its images are saved
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-job')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, item_id, grid_path, detail_paths):
+        paths = ([grid_path] if grid_path else []) + detail_paths
+        return self._submit(self._upload_images, item_id, paths, grid_path, detail_paths)
+
+    # Resized copies of an item whose originals are already uploaded (see post_item);
+    # detail_paths are (position, path) of its item_images rows
+    def submit_variants(self, item_id, grid_path, detail_paths=()):
+        detail_paths = list(detail_paths)
+        paths = ([grid_path] if grid_path else []) + [path for _, path in detail_paths]
+        return self._submit(self._upload_variants, item_id, paths, grid_path, detail_paths)
+
+    # Other background work (web imports) runs on the same bounded workers
+    def submit_job(self, func, *args):
+        return self.executor.submit(func, *args)
+
+    def _submit(self, work, item_id, paths, *args):
+        with self._lock:
+            self.pending += 1
+        return self.executor.submit(self._run, work, item_id, paths, *args)
+
+    # Run one job, then notify and count it and remove its spooled files, unless its uploads
+    # failed and it is scheduled to run again
+    def _run(self, work, item_id, paths, *args, attempt=0):
+        retrying = False
+        try:
+            work(item_id, *args)
+            if self.on_update:
+                self.on_update(item_id)
+            with self._lock:
+                self.completed += 1
+        except UploadError as e:
+            if attempt < self.retries:
+                delay = self.retry_delay * 2 ** attempt
+                self.uploader.logger.warning("Uploads for item %s failed (%s); retrying in %ss", item_id, e, delay)
+                timer = threading.Timer(delay, self.executor.submit, (self._run, work, item_id, paths) + args,
+                                        {'attempt': attempt + 1})
+                timer.daemon = True
+                timer.start()
+                retrying = True
+            else:
+                self.uploader.logger.error("Giving up on uploads for item %s after %d attempts: %s",
+                                           item_id, attempt + 1, e)
+                with self._lock:
+                    self.failed += 1
+        except Exception:
+            self.uploader.logger.exception("Error finishing uploads for item %s", item_id)
+            with self._lock:
+                self.failed += 1
+        finally:
+            if not retrying:
+                with self._lock:
+                    self.pending -= 1
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    # Make and upload the variants of each image in one batch; returns {path: {mime: {width: url}}}
+    def _make_variants(self, paths):
+        derivatives = {path: make_derivatives(path, path, self.uploader.logger) for path in paths}
+        urls = self.uploader.upload_many([file for path in paths for _, _, file in derivatives[path]])
+        variants, offset = {}, 0
+        for path in paths:
+            count = len(derivatives[path])
+            variants[path] = collect_variants(derivatives[path], urls[offset:offset + count])
+            offset += count
+        return variants
+
+    def _upload_images(self, item_id, grid_path, detail_paths):
+        paths = ([grid_path] if grid_path else []) + detail_paths
+        urls = self.uploader.upload_many(paths)
+        # Like the foreground path, never publish a partial set; the whole job is retried
+        if None in urls:
+            raise UploadError(f"{urls.count(None)} of {len(urls)} images could not be uploaded")
+        variants = self._make_variants(paths)
+        grid_url = urls.pop(0) if grid_path else None
+        grid_variants = variants.get(grid_path) or {}
+        detail_rows = [(url,) + image_size(path) + (variants.get(path),) for path, url in zip(detail_paths, urls)]
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE items SET grid_image = %s, grid_variants = %s WHERE id = %s",
+                (grid_url, json.dumps(grid_variants) if grid_variants else None, item_id)
+            )
+            save_item_images(cursor, item_id, detail_rows)
+            add_refs(cursor, self.store, 'item', item_id,
+                     [grid_url] + [row[0] for row in detail_rows] + variant_urls(grid_variants) +
+                     [url for row in detail_rows for url in variant_urls(row[3] or {})])
+            conn.commit()
+            cursor.close()
+
+    def _upload_variants(self, item_id, grid_path, detail_paths):
+        variants = self._make_variants(([grid_path] if grid_path else []) + [path for _, path in detail_paths])
+        detail_rows = [(json.dumps(variants[path]), item_id, position) for position, path in detail_paths if variants[path]]
+        if not (variants.get(grid_path) or detail_rows):
+            return
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if variants.get(grid_path):
+                cursor.execute("UPDATE items SET grid_variants = %s WHERE id = %s",
+                               (json.dumps(variants[grid_path]), item_id))
+            if detail_rows:
+                cursor.executemany("UPDATE item_images SET variants = %s WHERE item_id = %s AND position = %s",
+                                   detail_rows)
+            add_refs(cursor, self.store, 'item', item_id,
+                     [url for path_variants in variants.values() for url in variant_urls(path_variants)])
+            conn.commit()
+            cursor.close()
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self.pending, 'completed': self.completed, 'failed': self.failed}
+
+
+def init_app(app, on_update=None):
+    app.config.setdefault('UPLOAD_BACKEND', os.environ.get('UPLOAD_BACKEND', 'cloudinary'))
+    app.config.setdefault('UPLOAD_CONCURRENCY', int(os.environ.get('UPLOAD_CONCURRENCY', 4)))
+    app.config.setdefault('UPLOAD_TIMEOUT', float(os.environ.get('UPLOAD_TIMEOUT', 30)))
+    app.config.setdefault('UPLOAD_RETRIES', int(os.environ.get('UPLOAD_RETRIES', 2)))
+    app.config.setdefault('UPLOAD_IN_BACKGROUND', os.environ.get('UPLOAD_IN_BACKGROUND', '0') == '1')
+    # Background jobs whose uploads fail run again this many times, the first after this many seconds
+    app.config.setdefault('UPLOAD_QUEUE_RETRIES', int(os.environ.get('UPLOAD_QUEUE_RETRIES', 3)))
+    app.config.setdefault('UPLOAD_QUEUE_RETRY_DELAY', float(os.environ.get('UPLOAD_QUEUE_RETRY_DELAY', 30)))
+
+    if app.config['UPLOAD_BACKEND'] == 'local':
+        backend = LocalBackend(app.extensions['blob_store'])
+    else:
+        backend = BACKENDS[app.config['UPLOAD_BACKEND']]()
+    uploader = Uploader(
+        backend,
+        max_workers=app.config['UPLOAD_CONCURRENCY'],
+        timeout=app.config['UPLOAD_TIMEOUT'],
+        retries=app.config['UPLOAD_RETRIES'],
+        logger=app.logger,
+    )
+    app.extensions['uploader'] = uploader
+    app.extensions['upload_queue'] = UploadQueue(
+        uploader, app.extensions['db_pool'], app.extensions['blob_store'], on_update=on_update,
+        retries=app.config['UPLOAD_QUEUE_RETRIES'], retry_delay=app.config['UPLOAD_QUEUE_RETRY_DELAY'],
+    )